@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+"""Compares printing a billing run of virtual barcodes with barcodes() against calling barcode() for each
+
+Run from the repository root with: PYTHONPATH=. python benchmarks/barcodes.py"""
+from __future__ import print_function
+
+import datetime
+import timeit
+from decimal import Decimal
+
+from holviapi.utils import barcode, barcodes, fin_references
+
+IBAN = "FI79 4405 2020 0360 82"
+DUE = datetime.date(2016, 1, 20)
+ROWS = [(reference, Decimal("%d.%02d" % (n % 1000, n % 100)), DUE)
+        for (n, reference) in enumerate(fin_references(range(100000, 120000)))]
+CSV_ROWS = [(reference, str(amount), due.isoformat()) for (reference, amount, due) in ROWS]
+
+
+def per_call():
+    for row in ROWS:
+        barcode(IBAN, *row)
+
+
+def bulk():
+    for code in barcodes(IBAN, ROWS):
+        pass
+
+
+def bulk_strings():
+    for code in barcodes(IBAN, CSV_ROWS):
+        pass
+
+
+def main():
+    rounds = 5
+    slow = min(timeit.repeat(per_call, number=rounds, repeat=3))
+    fast = min(timeit.repeat(bulk, number=rounds, repeat=3))
+    strings = min(timeit.repeat(bulk_strings, number=rounds, repeat=3))
+    print("%d barcodes, %d rounds" % (len(ROWS), rounds))
+    print("barcode(): %.3fs" % slow)
+    print("barcodes(): %.3fs (%.1fx)" % (fast, slow / fast))
+    print("barcodes() from strings: %.3fs (%.1fx)" % (strings, slow / strings))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+"""Compares mapping an order page with the fast ISO 8601 parser against dateutil
+
+Run from the repository root with: PYTHONPATH=. python benchmarks/dates.py"""
+from __future__ import print_function
+
+import timeit
+
+import dateutil.parser
+import holviapi
+import holviapi.checkout
+from holviapi.utils import parse_datetime
+
+
+def _order(n):
+    timestamp = "2016-%02d-%02dT%02d:%02d:%02d.%06dZ" % (n % 12 + 1, n % 28 + 1, n % 24, n % 60, (n * 7) % 60, n * 13)
+    return {
+        "code": "order%d" % n,
+        "buyer": {"email": "buyer%d@example.com" % n},
+        "create_time": timestamp,
+        "update_time": timestamp,
+        "paid_time": timestamp,
+        "cancel_time": None,
+        "purchases": [{
+            "product": {"code": "product%d" % p, "name": "Product"},
+            "create_time": timestamp,
+            "update_time": timestamp,
+            "net": "10.00",
+            "gross": "12.40",
+            "answers": [],
+        } for p in range(2)],
+    }
+
+
+PAGE = [_order(n) for n in range(100)]
+
+
+def map_page():
+    api = holviapi.CheckoutAPI(holviapi.Connection('benchpool', 'benchkey'))
+    for jsondata in PAGE:
+        order = holviapi.Order(api, dict(jsondata))
+        order.create_time, order.update_time, order.paid_time, order.cancel_time
+        for item in order.purchases:
+            item.create_time, item.update_time
+
+
+def main():
+    rounds = 50
+    fast = min(timeit.repeat(map_page, number=rounds, repeat=3))
+    holviapi.checkout.parse_datetime = lambda value: dateutil.parser.parse(value) if value else None
+    try:
+        slow = min(timeit.repeat(map_page, number=rounds, repeat=3))
+    finally:
+        holviapi.checkout.parse_datetime = parse_datetime
+    print("order page of %d, %d rounds" % (len(PAGE), rounds))
+    print("dateutil: %.3fs" % slow)
+    print("fast path: %.3fs (%.1fx)" % (fast, slow / fast))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,437 @@
+# -*- coding: utf-8 -*-
+"""asyncio counterparts of Connection and the API classes, requires Python 3.7+ and aiohttp
+
+The async APIs return the same Invoice/Order/Product/Category objects as the blocking ones, their
+lists are iterated with `async for` and lazy objects must be loaded with `await fetch(obj)`
+before accessing other attributes than code.
+"""
+import asyncio
+import contextvars
+import json
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+from .cache import cache_key
+from .columns import invoice_columns, order_columns
+from .categories import (CategoriesAPI, ExpenseCategory, ExpenseCategoryList, IncomeCategory, IncomeCategoryList,
+                         index_categories)
+from .checkout import CheckoutAPI, Order, OrderList
+from .connection import Connection, now, waiter_error
+from .bulk import ITEM_ERRORS, rate_limiter
+from .errors import ApiConnectionError, ApiTimeout, HolviError
+from .invoicing import Invoice, InvoiceAPI, InvoiceList
+from .products import Product, ProductList, ProductQuestion, ProductsAPI, index_products
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+
+async def fetch(obj):
+    """Awaitable counterpart of the lazy-loading in HolviObject.__getattr__, returns obj"""
+    if not obj._lazy or (obj._fetch_method is None and not obj._batch_resolved):
+        return obj
+    obj.api.connection.metrics.record_lazy_fetch(obj.__class__.__name__)
+    if obj._batch_resolved:
+        # Like _load_lazy: references not found by the batch stay lazy
+        await obj.api.resolve_references()
+        return obj
+    new = obj._fetch_method(obj.code)
+    if hasattr(new, '__await__'):
+        new = await new
+    if new is None:
+        raise HolviError("%s %s not found" % (obj.__class__.__name__, obj.code))
+    obj._update_from(new)
+    return obj
+
+
+class AsyncConnection(Connection):
+    """Connection making its requests with aiohttp, the make_* methods are coroutines
+
+    Shares the cache semantics of Connection, pool_maxsize limits the number of simultaneous connections.
+    Use as async context manager or call close() when done. Deadlines (see Connection.deadline) are per-task."""
+
+    def __init__(self, *args, **kwargs):
+        super(AsyncConnection, self).__init__(*args, **kwargs)
+        self._deadline_var = contextvars.ContextVar('holviapi_deadline', default=None)
+
+    def _get_deadline(self):
+        return self._deadline_var.get()
+
+    def _set_deadline(self, at):
+        self._deadline_var.set(at)
+
+    def _init_session(self):
+        """Initializes a aiohttp.ClientSession for us if not already initialized, must be called from a coroutine"""
+        if aiohttp is None:
+            raise ImportError("AsyncConnection requires aiohttp")
+        if not self.session:
+            self.session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=self.pool_maxsize), headers={
+                'Content-Type': 'application/json',
+                'Authorization': 'Token %s' % self.key
+            })
+        return self.session
+
+    async def warmup(self, connections=None):
+        """Opens (up to) connections connections to Holvi, see Connection.warmup"""
+        if connections is None:
+            connections = self.pool_maxsize
+        session = self._init_session()
+        connect, read = self._request_timeout()
+        timeout = aiohttp.ClientTimeout(sock_connect=connect, sock_read=read, total=self._remaining())
+
+        async def head():
+            try:
+                async with session.head(self.base_url_fmt, timeout=timeout):
+                    pass
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                pass  # Warming up is best effort, the real requests will report errors
+
+        await asyncio.gather(*[head() for x in range(connections)])
+
+    async def close(self):
+        if self.session:
+            await self.session.close()
+            self.session = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        await self.close()
+
+    async def _request(self, method, url, **kwargs):
+        """Makes the request and returns the result as requests.Response so we can share the error handling"""
+        session = self._init_session()
+        async with session.request(method, url, **kwargs) as resp:
+            body = await resp.read()
+        r = requests.Response()
+        r.status_code = resp.status
+        r.reason = resp.reason
+        r.url = str(resp.url)
+        r.headers = CaseInsensitiveDict(resp.headers)
+        r.encoding = resp.charset or 'utf-8'
+        r._content = body
+        return r
+
+    async def _send(self, method, url, **kwargs):
+        """Makes the request with retries (see self.retry), returns the response or raises our exceptions"""
+        if self.circuit_breaker is not None:
+            self.circuit_breaker.before_request()
+        attempt = 0
+        try:
+            while True:
+                r, error = None, None
+                connect, read = self._request_timeout()
+                timeout = aiohttp.ClientTimeout(sock_connect=connect, sock_read=read, total=self._remaining())
+                started = now()
+                try:
+                    r = await self._request(method, url, timeout=timeout, **kwargs)
+                except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    error = e
+                self._record_attempt(method, url, r, started)
+                wait = self.retry.get_backoff(method, attempt, r, error)
+                if wait is None:
+                    break
+                try:
+                    remaining = self._remaining()
+                except ApiTimeout:
+                    break  # The deadline passed during the attempt, its result is final
+                if remaining is not None and wait >= remaining:
+                    break
+                self.metrics.record_retry(method, url)
+                await asyncio.sleep(wait)
+                attempt += 1
+        except BaseException:
+            # The request did not get a result (deadline passed, interrupted or cancelled), this tells nothing about
+            # Holvi but must end the trial request of a half-open circuit
+            if self.circuit_breaker is not None:
+                self.circuit_breaker.release_trial()
+            raise
+        self._record_result(r, error)
+        if isinstance(error, asyncio.TimeoutError):
+            raise ApiTimeout("Timed out: %s %s" % (method.upper(), url)) from error
+        if isinstance(error, aiohttp.ClientConnectionError):
+            raise ApiConnectionError("%s: %s %s" % (error, method.upper(), url)) from error
+        self._raise_for_result(r, error)
+        return r
+
+    async def make_get(self, url, params={}):
+        """Make a GET request, results are cached
+
+        Concurrent calls for the same url and params share a single request"""
+        key = cache_key(url, params)
+        cached = self.cache.get(key)
+        self.metrics.record_cache(url, cached is not None)
+        if cached is not None:
+            return json.loads(cached)
+        while key in self._inflight:
+            inflight = self._inflight[key]
+            try:
+                return json.loads(await asyncio.wait_for(asyncio.shield(inflight), self._remaining()))
+            except asyncio.TimeoutError:
+                raise ApiTimeout("Deadline exceeded while waiting for the same request made by another task")
+            except BaseException:
+                if not inflight.done() or inflight.cancelled():
+                    raise  # We were cancelled
+                error = waiter_error(inflight.exception())
+                if error is not None:
+                    raise error
+        inflight = self._inflight[key] = asyncio.get_running_loop().create_future()
+        try:
+            r = await self._send('get', url, params=params)
+            self.cache.set(key, r.text)
+            inflight.set_result(r.text)
+        except BaseException as e:
+            inflight.set_exception(e)
+            # Mark retrieved so asyncio does not complain when nobody else was waiting
+            inflight.exception()
+            raise
+        finally:
+            del self._inflight[key]
+        return r.json()
+
+    async def make_get_derived(self, url, name, derive, params={}):
+        key = cache_key(url, params)
+        value = self._derived_value(name, key)
+        if value is not None:
+            self.metrics.record_cache(url, True)
+            return value
+        return self._derive(name, key, derive, await self.make_get(url, params))
+
+    async def _make_ppp(self, method, url, payload, invalidate=()):
+        """Internal helper to make POST/PUT/PATCH requests, see Connection._make_ppp"""
+        try:
+            r = await self._send(method, url, json=payload)
+        finally:
+            # We can't trust the cache for this resource after we have made changes of our own
+            self._invalidate_mutated(method, url, invalidate)
+        return r.json()
+
+
+class AsyncHolviObjectList(object):
+    """Mixin for HolviObjectList subclasses whose api uses AsyncConnection, iterate with `async for`
+
+    Reading ahead and streaming are not supported."""
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        while True:
+            try:
+                return self._klass(self.api, next(self._iter))
+            except StopIteration:
+                if not await self._fetch_next_page():
+                    raise StopAsyncIteration
+
+    async def _fetch_next_page(self):
+        """Replaces self.jsondata with the next page, returns False if there is none"""
+        next_url = self._next_url()
+        if not next_url:
+            return False
+        with self.api.connection.deadline_at(self._deadline):
+            self.jsondata = await self.api.connection.make_get(next_url)
+        self._get_iter()
+        return True
+
+    async def _read_jsondata(self):
+        """Returns list of the JSON dicts of the remaining items (fetching next pages as needed)"""
+        items = []
+        while True:
+            items.extend(self._iter)
+            if not await self._fetch_next_page():
+                return items
+
+    def _iter_jsondata(self):
+        raise TypeError("%s must be iterated with async for" % self.__class__.__name__)
+
+    def read_ahead(self, depth=1):
+        raise TypeError("%s does not support read_ahead" % self.__class__.__name__)
+
+    def __next__(self):
+        raise TypeError("%s must be iterated with async for" % self.__class__.__name__)
+
+
+class AsyncInvoiceList(AsyncHolviObjectList, InvoiceList):
+
+    async def to_columns(self):
+        """Coroutine counterpart of InvoiceList.to_columns(), the remaining pages are read to memory first"""
+        return invoice_columns(await self._read_jsondata())
+
+
+class AsyncOrderList(AsyncHolviObjectList, OrderList):
+
+    async def to_columns(self):
+        """Coroutine counterpart of OrderList.to_columns(), the remaining pages are read to memory first"""
+        return order_columns(await self._read_jsondata())
+
+
+class AsyncProductList(AsyncHolviObjectList, ProductList):
+    pass
+
+
+class AsyncIncomeCategoryList(AsyncHolviObjectList, IncomeCategoryList):
+    pass
+
+
+class AsyncExpenseCategoryList(AsyncHolviObjectList, ExpenseCategoryList):
+    pass
+
+
+class AsyncCategoriesAPI(CategoriesAPI):
+    """asyncio counterpart of CategoriesAPI"""
+
+    async def list_income_categories(self):
+        obdata = await self.connection.make_get(self.base_url)
+        return AsyncIncomeCategoryList(obdata, self)
+
+    async def list_expense_categories(self):
+        obdata = await self.connection.make_get(self.base_url)
+        return AsyncExpenseCategoryList(obdata, self)
+
+    async def get_category(self, code):
+        return self._category(await self.connection.make_get_derived(self.base_url, 'categories', index_categories), code)
+
+    async def resolve_references(self):
+        income = self.connection.identity_map.pending(IncomeCategory)
+        expense = self.connection.identity_map.pending(ExpenseCategory)
+        if not income and not expense:
+            return 0
+        index = await self.connection.make_get_derived(self.base_url, 'categories', index_categories)
+        return self._hydrate_references(index, income, expense)
+
+
+class AsyncProductsAPI(ProductsAPI):
+    """asyncio counterpart of ProductsAPI"""
+
+    def __init__(self, connection):
+        super(AsyncProductsAPI, self).__init__(connection)
+        self.categories_api = AsyncCategoriesAPI(self.connection)
+
+    async def list_products(self):
+        obdata = await self.connection.make_get(self.base_url)
+        return AsyncProductList(obdata, self)
+
+    async def get_product(self, code):
+        products, questions = await self.connection.make_get_derived(self.base_url, 'products', index_products)
+        return self._product(products, code)
+
+    async def resolve_references(self):
+        products = self.connection.identity_map.pending(Product)
+        questions = self.connection.identity_map.pending(ProductQuestion)
+        if not products and not questions:
+            return 0
+        index = await self.connection.make_get_derived(self.base_url, 'products', index_products)
+        return self._hydrate_references(index, products, questions)
+
+
+class AsyncInvoiceAPI(InvoiceAPI):
+    """asyncio counterpart of InvoiceAPI, use save_invoice/send_invoice/void_invoice instead of the Invoice methods"""
+
+    def __init__(self, connection):
+        super(AsyncInvoiceAPI, self).__init__(connection)
+        self.categories_api = AsyncCategoriesAPI(self.connection)
+
+    async def list_invoices(self, **kwargs):
+        if kwargs.pop('stream', False):
+            raise TypeError("Streaming is not supported by AsyncInvoiceAPI")
+        invoices = await self.connection.make_get(self.base_url, params=kwargs)
+        return AsyncInvoiceList(invoices, self)
+
+    async def get_invoice(self, invoice_code):
+        url = self.base_url + '{code}/'.format(code=invoice_code)
+        ijson = await self.connection.make_get(url)
+        return Invoice(self, ijson)
+
+    async def save_invoice(self, invoice):
+        """Saves invoice to Holvi, returns the created/updated invoice"""
+        method, url, payload = invoice._save_request()
+        stat = await self.connection._make_ppp(method, url, payload)
+        return invoice._saved(stat)
+
+    async def create_many(self, invoices, concurrency=4):
+        """Creates new invoices in Holvi posting up to concurrency of them at a time, see InvoiceAPI.create_many"""
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def create(request):
+            if isinstance(request, HolviError):
+                return request
+            invoice, url, payload = request
+            try:
+                async with semaphore:
+                    r = await self.connection._send('post', url, json=payload)
+                return invoice._saved(r.json())
+            except ITEM_ERRORS + (aiohttp.ClientError,) as e:
+                return e
+
+        try:
+            return await asyncio.gather(*[create(self._prepare_create(invoice)) for invoice in invoices])
+        finally:
+            self.connection._invalidate_mutated('post', self.base_url)
+
+    async def _update_status_many(self, invoices, payload, concurrency, rate):
+        codes = self._unique_codes(invoices)
+        semaphore = asyncio.Semaphore(concurrency)
+        limiter = rate_limiter(rate)
+
+        async def update(code):
+            try:
+                async with semaphore:
+                    if limiter is not None:
+                        await asyncio.sleep(limiter.reserve())
+                    return await self.connection.make_put(self._status_url(code), payload)
+            except ITEM_ERRORS + (aiohttp.ClientError,) as e:
+                return e
+
+        return dict(zip(codes, await asyncio.gather(*[update(code) for code in codes])))
+
+    async def send_many(self, invoices, send_email=True, concurrency=4, rate=None):
+        """Marks invoices as sent in Holvi, see InvoiceAPI.send_many"""
+        return await self._update_status_many(invoices, {'mark_as_sent': True, 'send_email': send_email},
+                                              concurrency, rate)
+
+    async def void_many(self, invoices, concurrency=4, rate=None):
+        """Marks invoices as void in Holvi, see InvoiceAPI.send_many"""
+        return await self._update_status_many(invoices, {'void': True}, concurrency, rate)
+
+    async def send_invoice(self, invoice, send_email=True):
+        """Marks the invoice as sent in Holvi, see Invoice.send"""
+        payload = {
+            'mark_as_sent': True,
+            'send_email': send_email,
+        }
+        return await self.connection.make_put(invoice._status_url(), payload)
+
+    async def void_invoice(self, invoice):
+        """Mark invoice as void in Holvi"""
+        return await self.connection.make_put(invoice._status_url(), {'void': True})
+
+
+class AsyncCheckoutAPI(CheckoutAPI):
+    """asyncio counterpart of CheckoutAPI, use save_order instead of Order.save"""
+
+    def __init__(self, connection):
+        super(AsyncCheckoutAPI, self).__init__(connection)
+        self.categories_api = AsyncCategoriesAPI(self.connection)
+        self.products_api = AsyncProductsAPI(self.connection)
+
+    async def list_orders(self, **kwargs):
+        if kwargs.pop('stream', False):
+            raise TypeError("Streaming is not supported by AsyncCheckoutAPI")
+        url = self.base_url + "pool/{pool}/order/".format(pool=self.connection.pool)
+        orders = await self.connection.make_get(url, params=kwargs)
+        return AsyncOrderList(orders, self)
+
+    async def get_order(self, order_code):
+        url = self.base_url + "order/{code}".format(code=order_code)
+        ojson = await self.connection.make_get(url)
+        return Order(self, ojson)
+
+    async def save_order(self, order):
+        """Saves order to Holvi, returns a tuple with the order itself and checkout_uri"""
+        url, payload, invalidate = order._save_request()
+        stat = await self.connection.make_post(url, payload, invalidate=invalidate)
+        return (stat["checkout_uri"], await self.get_order(Order._saved_code(stat)))
@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+
+import threading
+import time
+
+from future.builtins import next, object, range
+from requests.exceptions import RequestException
+
+from .connection import now
+from .errors import HolviError
+
+# Exceptions returned as the result of an item instead of raising, others abort the whole batch
+ITEM_ERRORS = (HolviError, RequestException)
+
+
+class RateLimiter(object):
+    """Limits calls to rate per second on average allowing bursts of up to burst calls, thread-safe
+
+    Share one instance between batches (and threads) to keep them all within the same limit."""
+
+    def __init__(self, rate, burst=1):
+        self.interval = 1.0 / rate
+        self.burst = burst
+        self._next = 0.0  # When the next call would be due if calls were evenly spaced
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        """Reserves the next slot, returns the seconds to wait before making the call"""
+        with self._lock:
+            t = now()
+            due = max(self._next, t)
+            self._next = due + self.interval
+            return max(0.0, due - t - (self.burst - 1) * self.interval)
+
+    def acquire(self):
+        """Blocks until the next call may be made"""
+        wait = self.reserve()
+        if wait > 0:
+            time.sleep(wait)
+
+
+def rate_limiter(rate):
+    """RateLimiter for rate (calls per second), None or a RateLimiter is returned as is"""
+    if rate is None or isinstance(rate, RateLimiter):
+        return rate
+    return RateLimiter(rate)
+
+
+def map_concurrently(func, items, concurrency=4, rate=None):
+    """Calls func(item) for each of items in up to concurrency threads, returns the results in the order of items
+
+    rate limits the calls per second (None for no limit), it can also be a RateLimiter.
+    ITEM_ERRORS raised by func are returned as the result of the item. Other exceptions stop the remaining items
+    from being started and the first one is raised once the running calls have finished."""
+    limiter = rate_limiter(rate)
+    items = list(items)
+    results = [None] * len(items)
+    indexes = iter(range(len(items)))
+    lock = threading.Lock()
+    aborted = []
+
+    def worker():
+        while True:
+            with lock:
+                i = None if aborted else next(indexes, None)
+            if i is None:
+                return
+            if limiter is not None:
+                limiter.acquire()
+            try:
+                results[i] = func(items[i])
+            except ITEM_ERRORS as e:
+                results[i] = e
+            except Exception as e:
+                with lock:
+                    aborted.append(e)
+                return
+
+    threads = [threading.Thread(target=worker) for x in range(min(max(concurrency, 1), len(items)))]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    if aborted:
+        raise aborted[0]
+    return results
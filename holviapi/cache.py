@@ -0,0 +1,274 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+
+import itertools
+import os
+import random
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, deque
+
+from future.builtins import object
+from six.moves.urllib.parse import urlencode
+
+
+def cache_key(url, params=None):
+    """Cache key for a GET to url with given params, params are sorted so the order of kwargs does not matter"""
+    if not params:
+        return url
+    return "%s?%s" % (url, urlencode(sorted(params.items()), doseq=True))
+
+
+class BaseCache(object):
+    """Baseclass for Connection response caches
+
+    Caches map keys (see cache_key) to raw response bodies, entries expire expire_after seconds
+    after they were set (None means never). Subclass and implement the methods below to plug in your own storage.
+    """
+    expire_after = 300
+
+    def __init__(self, expire_after=300):
+        self.expire_after = expire_after
+
+    def _expires(self):
+        if self.expire_after is None:
+            return None
+        return time.time() + self.expire_after
+
+    def get(self, key):
+        """Return the cached body for key or None if not cached (or expired)"""
+        raise NotImplementedError()
+
+    def set(self, key, value):
+        """Store body for key"""
+        raise NotImplementedError()
+
+    def version(self, key):
+        """Token that changes whenever key is set again, None if key is not cached (or expired)
+
+        Used to tell if a value derived from the body is still current, by default the body itself. Override with
+        something cheaper to compare."""
+        return self.get(key)
+
+    def delete(self, key):
+        """Forget key, must not fail if key is not cached"""
+        raise NotImplementedError()
+
+    def delete_prefix(self, prefix):
+        """Forget all keys starting with prefix, by default clears the whole cache"""
+        self.clear()
+
+    def clear(self):
+        """Forget everything"""
+        raise NotImplementedError()
+
+
+class NullCache(BaseCache):
+    """Does not cache anything, use to disable caching"""
+
+    def get(self, key):
+        return None
+
+    def set(self, key, value):
+        pass
+
+    def delete(self, key):
+        pass
+
+    def delete_prefix(self, prefix):
+        pass
+
+    def clear(self):
+        pass
+
+
+class MemoryCache(BaseCache):
+    """Per-process in-memory LRU cache, lost when the process exits
+
+    max_entries and max_bytes (length of keys and bodies) bound the cache, least recently used entries are evicted
+    first, None means no limit. Expired entries are dropped when looked up and a few at a time on each set, call
+    purge_expired() to drop all of them."""
+
+    def __init__(self, expire_after=300, max_entries=1024, max_bytes=64 * 1024 * 1024):
+        super(MemoryCache, self).__init__(expire_after)
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._data = OrderedDict()  # key -> (expires, value, version), least recently used first
+        self._expiry = deque()  # (expires, key) in the order they were set
+        self._versions = itertools.count()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def _remove(self, key):
+        entry = self._data.pop(key)
+        self.size -= len(key) + len(entry[1])
+
+    def _expire(self, limit=None):
+        """Drops (up to limit) expired entries, oldest first"""
+        now = time.time()
+        while self._expiry and self._expiry[0][0] < now and limit != 0:
+            expires, key = self._expiry.popleft()
+            entry = self._data.get(key)
+            # The key may have been set again or evicted since
+            if entry is not None and entry[0] == expires:
+                self._remove(key)
+            if limit is not None:
+                limit -= 1
+        # Entries for keys set again or evicted linger until they expire, do not let them pile up
+        if len(self._expiry) > 2 * len(self._data) + 64:
+            self._expiry = deque(sorted((entry[0], key) for key, entry in self._data.items() if entry[0] is not None))
+
+    def _evict(self):
+        while self._data and ((self.max_entries is not None and len(self._data) > self.max_entries)
+                              or (self.max_bytes is not None and self.size > self.max_bytes)):
+            self._remove(next(iter(self._data)))
+
+    def _lookup(self, key):
+        """The live entry for key (marked as most recently used) or None, must hold the lock"""
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        if entry[0] is not None and entry[0] < time.time():
+            self._remove(key)
+            return None
+        self._data[key] = self._data.pop(key)
+        return entry
+
+    def get(self, key):
+        with self._lock:
+            entry = self._lookup(key)
+            return None if entry is None else entry[1]
+
+    def version(self, key):
+        with self._lock:
+            entry = self._lookup(key)
+            return None if entry is None else entry[2]
+
+    def set(self, key, value):
+        with self._lock:
+            if key in self._data:
+                self._remove(key)
+            expires = self._expires()
+            self._data[key] = (expires, value, next(self._versions))
+            self.size += len(key) + len(value)
+            if expires is not None:
+                self._expiry.append((expires, key))
+            self._expire(limit=2)
+            self._evict()
+
+    def delete(self, key):
+        with self._lock:
+            if key in self._data:
+                self._remove(key)
+
+    def delete_prefix(self, prefix):
+        with self._lock:
+            for key in [k for k in self._data if k.startswith(prefix)]:
+                self._remove(key)
+
+    def purge_expired(self):
+        """Drops all expired entries"""
+        with self._lock:
+            self._expire()
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._expiry.clear()
+            self.size = 0
+
+
+class SQLiteCache(BaseCache):
+    """On-disk cache in a SQLite database, survives process restarts and can be shared by processes on the same host
+
+    Each process opens its own connection when it first uses the cache, so it can be created before forking.
+    Expired entries are dropped when looked up and all of them every purge_every sets. Tables created by older
+    versions get the version column added on first use."""
+    purge_every = 100
+
+    def __init__(self, path='holvi_cache.sqlite', expire_after=300, table='responses'):
+        super(SQLiteCache, self).__init__(expire_after)
+        self.path = path
+        self.table = table
+        self._lock = threading.Lock()
+        self._db = None
+        self._pid = None
+        self._sets = 0
+
+    def _connection(self):
+        """The connection of this process, SQLite connections must not be used across fork()"""
+        if self._pid != os.getpid():
+            self._db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            self._pid = os.getpid()
+            self._db.execute("CREATE TABLE IF NOT EXISTS %s (key TEXT PRIMARY KEY, value TEXT, expires REAL, "
+                             "version INTEGER)" % self.table)
+            columns = [row[1] for row in self._db.execute("PRAGMA table_info(%s)" % self.table)]
+            if 'version' not in columns:
+                try:
+                    self._db.execute("ALTER TABLE %s ADD COLUMN version INTEGER" % self.table)
+                    self._db.execute("UPDATE %s SET version = random()" % self.table)
+                except sqlite3.OperationalError:
+                    pass  # Another process added it first
+        return self._db
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        del state['_lock']
+        state['_db'] = state['_pid'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            db = self._connection()
+            row = db.execute("SELECT value, expires FROM %s WHERE key = ?" % self.table, (key,)).fetchone()
+            if row is None:
+                return None
+            value, expires = row
+            if expires is not None and expires < time.time():
+                db.execute("DELETE FROM %s WHERE key = ?" % self.table, (key,))
+                return None
+            return value
+
+    def version(self, key):
+        with self._lock:
+            row = self._connection().execute("SELECT version, expires FROM %s WHERE key = ?" % self.table,
+                                             (key,)).fetchone()
+        if row is None or (row[1] is not None and row[1] < time.time()):
+            return None
+        return row[0]
+
+    def set(self, key, value):
+        with self._lock:
+            db = self._connection()
+            # Random so processes sharing the database do not need to agree on a counter
+            db.execute("INSERT OR REPLACE INTO %s (key, value, expires, version) VALUES (?, ?, ?, ?)" % self.table,
+                       (key, value, self._expires(), random.getrandbits(62)))
+            self._sets += 1
+            if self._sets % self.purge_every == 0:
+                db.execute("DELETE FROM %s WHERE expires < ?" % self.table, (time.time(),))
+
+    def purge_expired(self):
+        """Drops all expired entries"""
+        with self._lock:
+            self._connection().execute("DELETE FROM %s WHERE expires < ?" % self.table, (time.time(),))
+
+    def delete(self, key):
+        with self._lock:
+            self._connection().execute("DELETE FROM %s WHERE key = ?" % self.table, (key,))
+
+    def delete_prefix(self, prefix):
+        with self._lock:
+            self._connection().execute("DELETE FROM %s WHERE substr(key, 1, ?) = ?" % self.table,
+                                       (len(prefix), prefix))
+
+    def clear(self):
+        with self._lock:
+            self._connection().execute("DELETE FROM %s" % self.table)
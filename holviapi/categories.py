@@ -1,21 +1,24 @@
 # -*- coding: utf-8 -*-
 from __future__ import print_function
 
-import itertools
-
 from future.builtins import next, object
-from future.builtins.iterators import filter
 from future.utils import python_2_unicode_compatible, raise_from
 
+from .identity import hydrate
 from .utils import HolviObject, HolviObjectList, JSONObject
 
 
+def index_categories(obdata):
+    """Indexes the categories of openbudget response by code, returns (income, expense)"""
+    return ({c["code"]: c for c in obdata["income_categories"]}, {c["code"]: c for c in obdata["expense_categories"]})
+
+
 class Category(HolviObject):
     """Baseclass for income/expense categories, do not instantiate directly"""
+    _batch_resolved = True
 
     def __init__(self, api, jsondata=None, **kwargs):
-        self._fetch_method = api.get_category
-        super(Category, self).__init__(api, jsondata, **kwargs)
+        super(Category, self).__init__(api, jsondata, fetch_method=api.get_category, **kwargs)
 
 
 class IncomeCategory(Category):
@@ -76,10 +79,30 @@ class CategoriesAPI(object):
         return ExpenseCategoryList(obdata, self)
 
     def get_category(self, code):
-        """Gets category with given code
-
-        NOTE: Filters the list of income and expense categories in this end due to API limitations"""
-        candidates = list(filter(lambda c: c.code == code, itertools.chain(self.list_income_categories(), self.list_expense_categories())))
-        if not len(candidates):
-            return None
-        return candidates[0]
+        """Gets category with given code, None if there is no such category
+
+        NOTE: Looks the category up in this end due to API limitations, from an index of the open budget data that
+        is built once per response (see Connection.make_get_derived)"""
+        return self._category(self.connection.make_get_derived(self.base_url, 'categories', index_categories), code)
+
+    def _category(self, index, code):
+        income, expense = index
+        if code in income:
+            return IncomeCategory(self, dict(income[code]))
+        if code in expense:
+            return ExpenseCategory(self, dict(expense[code]))
+        return None
+
+    def resolve_references(self):
+        """Loads all lazy categories of the connection (see Connection.identity_map) with one openbudget fetch,
+        returns the number of categories loaded"""
+        income = self.connection.identity_map.pending(IncomeCategory)
+        expense = self.connection.identity_map.pending(ExpenseCategory)
+        if not income and not expense:
+            return 0
+        index = self.connection.make_get_derived(self.base_url, 'categories', index_categories)
+        return self._hydrate_references(index, income, expense)
+
+    @staticmethod
+    def _hydrate_references(index, income, expense):
+        return hydrate(income, index[0]) + hydrate(expense, index[1])
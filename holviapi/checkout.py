@@ -4,38 +4,47 @@ from __future__ import print_function
 import datetime
 from decimal import Decimal
 
-import dateutil.parser
 import six
 from future.builtins import next, object
 from future.utils import python_2_unicode_compatible, raise_from
 
 from .categories import CategoriesAPI, IncomeCategory
+from .columns import order_columns
 from .contacts import OrderContact
+from .errors import HolviError
 from .products import OrderProduct, ProductQuestion, ProductsAPI
-from .utils import HolviObject, HolviObjectList, JSONObject
+from .utils import HolviObject, HolviObjectList, JSONObject, decoded_property, json_fields, parse_datetime
 
 
+@json_fields("code")
 class Order(HolviObject):
     """This represents a checkout in the Holvi system"""
-    buyer = None
-    purchases = []
+    __slots__ = ('_buyer', '_purchases', '_create_time', '_update_time', '_processed_time', '_paid_time')
     _valid_keys = ("city", "lastname", "discount_code", "failure_url", "eu_vat_identifier", "postcode", "firstname", "notification_url", "country", "street", "pool", "cancel_url", "company", "success_url", "purchases", "email")
-    create_time = None
-    update_time = None
-    processed_time = None
-    paid_time = None
 
-    def _map_holvi_json_properties(self):
-        self.buyer = OrderContact({k: v for (k, v) in self._jsondata.items() if k in OrderContact._valid_keys})
-        self.purchases = []
-        for pdata in self._jsondata["purchases"]:
-            self.purchases.append(CheckoutItem(self, pdata))
-        for prop in ("create_time", "update_time", "processed_time", "paid_time"):
-            if prop not in self._jsondata:
-                continue
-            if not self._jsondata[prop]:
-                continue
-            setattr(self, prop, dateutil.parser.parse(self._jsondata[prop]))
+    @decoded_property
+    def buyer(self):
+        return OrderContact({k: v for (k, v) in self._jsondata.items() if k in OrderContact._valid_keys})
+
+    @decoded_property
+    def purchases(self):
+        return [CheckoutItem(self, pdata) for pdata in self._jsondata["purchases"]]
+
+    @decoded_property
+    def create_time(self):
+        return parse_datetime(self._jsondata.get("create_time"))
+
+    @decoded_property
+    def update_time(self):
+        return parse_datetime(self._jsondata.get("update_time"))
+
+    @decoded_property
+    def processed_time(self):
+        return parse_datetime(self._jsondata.get("processed_time"))
+
+    @decoded_property
+    def paid_time(self):
+        return parse_datetime(self._jsondata.get("paid_time"))
 
     def to_holvi_dict(self):
         if self.buyer:
@@ -75,8 +84,8 @@ class Order(HolviObject):
     def gross(self):
         return sum((x.gross for x in self.purchases))
 
-    def save(self):
-        """Saves this order to Holvi, returns a tuple with the order itself and checkout_uri"""
+    def _save_request(self):
+        """Returns (url, payload, invalidate) for creating this order"""
         if self.code:
             raise HolviError("Orders cannot be updated")
         send_json = self.to_holvi_dict()
@@ -84,47 +93,58 @@ class Order(HolviObject):
             'pool': self.api.connection.pool
         })
         url = six.u(self.api.base_url + "order/")
-        stat = self.api.connection.make_post(url, send_json)
-        code = stat["details_uri"].split("/")[-2]  # Maybe slightly ugly but I don't want to basically reimplement all but uri formation of the api method
-        return (stat["checkout_uri"], self.api.get_order(code))
+        list_url = self.api.base_url + "pool/{pool}/order/".format(pool=self.api.connection.pool)
+        return (url, send_json, (list_url,))
+
+    @staticmethod
+    def _saved_code(stat):
+        """Order code from the Holvi response to save"""
+        return stat["details_uri"].split("/")[-2]  # Maybe slightly ugly but I don't want to basically reimplement all but uri formation of the api method
+
+    def save(self):
+        """Saves this order to Holvi, returns a tuple with the order itself and checkout_uri"""
+        url, payload, invalidate = self._save_request()
+        stat = self.api.connection.make_post(url, payload, invalidate=invalidate)
+        return (stat["checkout_uri"], self.api.get_order(self._saved_code(stat)))
 
 
+@json_fields("code")
 class CheckoutItem(JSONObject):  # We extend JSONObject instead of HolviObject since there is no direct way to manipulate these
     """Pythonic wrapper for the items/purchaces in an Order"""
-    api = None
-    order = None
-    product = None
-    net = None
-    gross = None
-    _pklass = OrderProduct
+    __slots__ = ('api', 'order', '_product', 'net', 'gross', '_create_time', '_update_time', '_answers', '_pklass')
     _valid_keys = ("product", "answers", "detailed_price")
-    create_time = None
-    update_time = None
-    answers = []
 
     def __init__(self, order, holvi_dict={}, pklass=None):
         self.order = order
         self.api = self.order.api
-        if pklass:
-            self._pklass = pklass
+        self._pklass = pklass or OrderProduct
+        self.net = None
+        self.gross = None
         super(CheckoutItem, self).__init__(**holvi_dict)
         self._map_holvi_json_properties()
 
     def _map_holvi_json_properties(self):
-        if self._jsondata.get("product"):
-            self.product = self._pklass(self.api.products_api, {"code": self._jsondata["product"]})
         if "detailed_price" in self._jsondata:
             self.net = Decimal(self._jsondata["detailed_price"].get("net"))
             self.gross = Decimal(self._jsondata["detailed_price"].get("gross"))
-        for prop in ("create_time", "update_time"):
-            if prop not in self._jsondata:
-                continue
-            if not self._jsondata[prop]:
-                continue
-            setattr(self, prop, dateutil.parser.parse(self._jsondata[prop]))
-        self.answers = []
-        for adata in self._jsondata.get("answers", []):
-            self.answers.append(CheckoutItemAnswer(self, adata))
+
+    @decoded_property
+    def product(self):
+        if not self._jsondata.get("product"):
+            return None
+        return self.api.connection.identity_map.lazy(self._pklass, self.api.products_api, self._jsondata["product"])
+
+    @decoded_property
+    def create_time(self):
+        return parse_datetime(self._jsondata.get("create_time"))
+
+    @decoded_property
+    def update_time(self):
+        return parse_datetime(self._jsondata.get("update_time"))
+
+    @decoded_property
+    def answers(self):
+        return [CheckoutItemAnswer(self, adata) for adata in self._jsondata.get("answers", [])]
 
     def to_holvi_dict(self):
         if self.answers:
@@ -147,25 +167,23 @@ class CheckoutItem(JSONObject):  # We extend JSONObject instead of HolviObject s
         return filtered
 
 
+@json_fields()
 class CheckoutItemAnswer(JSONObject):  # We extend JSONObject instead of HolviObject since there is no direct way to manipulate these
     """Pythonic wrapper for the answers to product questions"""
-    api = None
-    item = None
-    question = None
+    __slots__ = ('api', 'item', '_question', '_qklass')
     _valid_keys = ("question", "label", "answer")
-    _qklass = ProductQuestion
 
     def __init__(self, item, holvi_dict={}, qklass=None):
         self.item = item
         self.api = self.item.api
-        if qklass:
-            self._qklass = qklass
+        self._qklass = qklass or ProductQuestion
         super(CheckoutItemAnswer, self).__init__(**holvi_dict)
-        self._map_holvi_json_properties()
 
-    def _map_holvi_json_properties(self):
-        if self._jsondata.get("question"):
-            self.question = self._qklass(self.item.product, {"code": self._jsondata["question"]})
+    @decoded_property
+    def question(self):
+        if not self._jsondata.get("question"):
+            return None
+        return self.api.connection.identity_map.lazy(self._qklass, self.item.product, self._jsondata["question"])
 
     def to_holvi_dict(self):
         if "label" not in self._jsondata:
@@ -187,6 +205,15 @@ class OrderList(HolviObjectList):
     def _get_iter(self):
         self._iter = iter(self.jsondata["results"])
 
+    def to_columns(self):
+        """Exports the (remaining) orders as columns without creating Order objects, returns dict of columns
+
+        There is a row for each purchase: code of the order, product code, net and gross of the purchase in integer
+        cents and create_time and paid_time of the order in seconds since epoch (holviapi.columns.MISSING if not
+        set), see holviapi.columns for the column types.
+        Combine with stream=True of CheckoutAPI.list_orders() to keep only the columns in memory."""
+        return order_columns(self._iter_jsondata())
+
 
 @python_2_unicode_compatible
 class CheckoutAPI(object):
@@ -220,14 +247,27 @@ class CheckoutAPI(object):
         All times are ISO datetimes, try for example '2016-01-20T00:00:00.0Z'.
 
         For other kinds of filtering use Pythons filter() function as usual.
+
+        Pass stream=True to decode the pages incrementally while iterating so only one order is in memory at a
+        time, streamed results are not cached.
         """
         url = self.base_url + "pool/{pool}/order/".format(pool=self.connection.pool)
+        if kwargs.pop('stream', False):
+            return OrderList(self.connection.make_get_streamed(url, params=kwargs, key="results"), self)
         orders = self.connection.make_get(url, params=kwargs)
         return OrderList(orders, self)
 
+    def _order_url(self, order_code):
+        return self.base_url + "order/{code}".format(code=order_code)
+
+    def invalidate_order(self, order_code):
+        """Drop the cached get_order response for order_code and the cached order listings"""
+        self.connection.invalidate(self._order_url(order_code))
+        self.connection.invalidate(self.base_url + "pool/{pool}/order/".format(pool=self.connection.pool))
+
     def get_order(self, order_code):
         """Retvieve given Order"""
-        url = self.base_url + "order/{code}".format(code=order_code)
+        url = self._order_url(order_code)
         ojson = self.connection.make_get(url)
         #print("Got ojson=%s" % ojson)
         return Order(self, ojson)
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+"""Columnar export of invoice and order listings, see InvoiceList.to_columns() and OrderList.to_columns()
+
+Integer columns are array.array of 64-bit ints, use numpy.frombuffer(column, dtype='int64') to get a numpy array
+without copying. String columns are lists."""
+from __future__ import print_function
+
+import calendar
+from array import array
+from decimal import ROUND_HALF_UP, Decimal
+
+import six
+
+from .utils import parse_datetime
+
+try:
+    array('q')
+    INT64 = 'q'
+except ValueError:  # Python 2 has no 'q', 'l' is 64 bits on the platforms that matter
+    INT64 = 'l'
+# Value of missing timestamps in integer columns
+MISSING = -2 ** 63
+
+
+def to_cents(value):
+    """Converts price like '12.40' to integer cents, rounding half up, None is 0"""
+    if value is None:
+        return 0
+    if isinstance(value, six.string_types):
+        whole, _, fraction = value.partition('.')
+        # Fast path for the usual two decimals
+        if not fraction or (len(fraction) <= 2 and fraction.isdigit()):
+            return int(whole + fraction.ljust(2, '0'))
+    return int((Decimal(str(value)) * 100).quantize(Decimal(1), rounding=ROUND_HALF_UP))
+
+
+def to_epoch(value):
+    """Converts ISO 8601 timestamp to seconds since epoch, naive ones are taken as UTC, None is MISSING"""
+    parsed = parse_datetime(value)
+    if parsed is None:
+        return MISSING
+    return calendar.timegm(parsed.utctimetuple())
+
+
+def _new_columns(strings, ints):
+    columns = {name: [] for name in strings}
+    columns.update({name: array(INT64) for name in ints})
+    return columns
+
+
+def invoice_columns(invoices):
+    """Builds the columns of InvoiceList.to_columns() from invoices (iterable of invoice JSON dicts)"""
+    columns = _new_columns(('code', 'status', 'category'), ('net', 'gross', 'create_time', 'paid_time'))
+    code, status, category = columns['code'].append, columns['status'].append, columns['category'].append
+    net, gross = columns['net'].append, columns['gross'].append
+    create_time, paid_time = columns['create_time'].append, columns['paid_time'].append
+    for invoice in invoices:
+        created = to_epoch(invoice.get("create_time"))
+        paid = to_epoch(invoice.get("paid_time"))
+        for item in invoice.get("items") or ():
+            price = item.get("detailed_price") or {}
+            code(invoice["code"])
+            status(invoice.get("status"))
+            category(item.get("category"))
+            net(to_cents(price.get("net")))
+            gross(to_cents(price.get("gross")))
+            create_time(created)
+            paid_time(paid)
+    return columns
+
+
+def order_columns(orders):
+    """Builds the columns of OrderList.to_columns() from orders (iterable of order JSON dicts)"""
+    columns = _new_columns(('code', 'product'), ('net', 'gross', 'create_time', 'paid_time'))
+    code, product = columns['code'].append, columns['product'].append
+    net, gross = columns['net'].append, columns['gross'].append
+    create_time, paid_time = columns['create_time'].append, columns['paid_time'].append
+    for order in orders:
+        created = to_epoch(order.get("create_time"))
+        paid = to_epoch(order.get("paid_time"))
+        for purchase in order.get("purchases") or ():
+            price = purchase.get("detailed_price") or {}
+            code(order["code"])
+            product(purchase.get("product"))
+            net(to_cents(price.get("net")))
+            gross(to_cents(price.get("gross")))
+            create_time(created)
+            paid_time(paid)
+    return columns
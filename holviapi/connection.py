@@ -1,55 +1,244 @@
 # -*- coding: utf-8 -*-
 from __future__ import print_function
 
+import copy
 import json
+import threading
+import time
 
 import requests
-import requests_cache
 import six
 from future.builtins import next, object
 from future.utils import python_2_unicode_compatible, raise_from
-from requests.exceptions import HTTPError, Timeout
+from requests.adapters import HTTPAdapter
+from requests.exceptions import ConnectionError, HTTPError, RequestException, Timeout
 
-from .errors import ApiError, ApiTimeout, AuthenticationError
+from .cache import MemoryCache, cache_key
+from .identity import IdentityMap
+from .jsonstream import StreamedPage
+from .errors import ApiConnectionError, ApiError, ApiTimeout, AuthenticationError
+from .retry import RetryPolicy
+from .stats import Metrics
 
-# Cache GET results for 5min to save Holvis bandwidth (also the API is a bit on the slow side so this makes things faster for us)
-requests_cache.install_cache('Holvi-REST', 'memory', expire_after=300)
 # Store multiple pool connections with singleton getter
 CONNECTION_MAP = {}
+CONNECTION_MAP_LOCK = threading.Lock()
+# Connection.make_get_derived memoizes values for at most this many responses, then starts over
+DERIVED_CACHE_SIZE = 64
+# Bytes read at a time by Connection.make_get_streamed
+STREAM_CHUNK_SIZE = 64 * 1024
+# Deadlines are compared against this clock
+now = getattr(time, 'monotonic', time.time)
+
+
+class _InflightGet(object):
+    """A GET being made by one thread that other threads asking for the same thing wait for"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.body = None
+        self.error = None
+
+    def wait(self, timeout=None):
+        """Returns the response body, None if the caller should make the request itself (see waiter_error)"""
+        if not self.done.wait(timeout):
+            raise ApiTimeout("Deadline exceeded while waiting for the same request made by another thread")
+        if self.error is not None:
+            error = waiter_error(self.error)
+            if error is not None:
+                raise error
+        return self.body
+
+
+def waiter_error(error):
+    """The exception to raise to a caller that waited for a request which failed with error, None if it should make
+    the request itself
+
+    Timeouts may come from the deadline of the one who made the request and interruptions (KeyboardInterrupt etc)
+    are about them only. Other errors are raised to each waiter as a copy of their own."""
+    if isinstance(error, ApiTimeout) or not isinstance(error, Exception):
+        return None
+    try:
+        return copy.copy(error)
+    except Exception:
+        return error
+
+
+class Deadline(object):
+    """Context manager setting the deadline for requests made by a Connection, see Connection.deadline"""
+
+    def __init__(self, connection, at):
+        self.connection = connection
+        self.at = at
+        self._previous = None
+
+    def __enter__(self):
+        self._previous = self.connection._get_deadline()
+        if self.at is not None and (self._previous is None or self.at < self._previous):
+            self.connection._set_deadline(self.at)
+        return self
+
+    def __exit__(self, *args):
+        self.connection._set_deadline(self._previous)
 
 
 @python_2_unicode_compatible
 class Connection(object):
     base_url_fmt = "https://holvi.com/api/"
     session = None
+    cache = None
+    retry = None
+    circuit_breaker = None
+    pool_connections = 10
+    pool_maxsize = 10
+    session_per_thread = False
+    timeout = (3.05, 30)
+    metrics = None
+    identity_map = None
 
     @classmethod
-    def singleton(self, poolname, authkey):
-        """Get a singleton of a connection"""
+    def singleton(self, poolname, authkey, **kwargs):
+        """Get a singleton of a connection, kwargs are only used when the singleton is first created"""
         global CONNECTION_MAP
-        mapkey = "%s:%s" % (poolname, authkey)
-        if not mapkey in CONNECTION_MAP:
-            CONNECTION_MAP[mapkey] = Connection(poolname, authkey)
-        return CONNECTION_MAP[mapkey]
+        mapkey = "%s:%s:%s" % (self.__name__, poolname, authkey)
+        with CONNECTION_MAP_LOCK:
+            if not mapkey in CONNECTION_MAP:
+                CONNECTION_MAP[mapkey] = self(poolname, authkey, **kwargs)
+            return CONNECTION_MAP[mapkey]
+
+    def __init__(self, poolname, authkey, cache=None, retry=None, circuit_breaker=None,
+                 pool_connections=10, pool_maxsize=10, session_per_thread=False, timeout=(3.05, 30),
+                 metrics=None):
+        """Pass a holviapi.cache backend as cache to control how GET results are cached.
+
+        By default GET results are cached in memory for 5min to save Holvis bandwidth (also the API is a bit on the slow side
+        so this makes things faster for us), use holviapi.cache.NullCache to disable caching.
+
+        retry is a holviapi.retry.RetryPolicy, by default failed GETs are retried 3 times (use NoRetry to disable),
+        pass a holviapi.retry.CircuitBreaker as circuit_breaker to fail fast while Holvi is down.
+
+        pool_connections and pool_maxsize are passed to the requests HTTPAdapter, set pool_maxsize to the number of
+        threads making requests concurrently. By default all threads share one session, with session_per_thread
+        each thread gets its own session (and connection pool).
 
-    def __init__(self, poolname, authkey):
+        timeout is the (connect, read) timeout in seconds for each request, use deadline() to limit the total time.
+
+        Request statistics are collected to metrics (a holviapi.stats.Metrics, created if not given), see stats().
+
+        Lazy references to products, categories and product questions are shared via identity_map (a
+        holviapi.identity.IdentityMap)."""
         self.pool = poolname
         self.key = authkey
+        if cache is None:
+            cache = MemoryCache(expire_after=300)
+        self.cache = cache
+        if retry is None:
+            retry = RetryPolicy()
+        self.retry = retry
+        self.circuit_breaker = circuit_breaker
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self.session_per_thread = session_per_thread
+        self.timeout = timeout
+        if metrics is None:
+            metrics = Metrics()
+        self.metrics = metrics
+        self.identity_map = IdentityMap()
+        self._derived = {}
+        self._inflight = {}
+        self._inflight_lock = threading.Lock()
+        self._session_lock = threading.Lock()
+        self._local = threading.local()
+
+    def deadline(self, seconds):
+        """Context manager, requests made in the block (including pagination of lists created in it, retries and
+        lazy-loading) must complete within seconds in total or ApiTimeout is raised
+
+        Nested deadlines can only make the deadline earlier. The deadline is per-thread."""
+        return self.deadline_at(now() + seconds)
+
+    def deadline_at(self, at):
+        """Like deadline() but takes the absolute time (from holviapi.connection.now) of the deadline, None for no-op"""
+        return Deadline(self, at)
+
+    def _get_deadline(self):
+        return getattr(self._local, 'deadline', None)
+
+    def _set_deadline(self, at):
+        self._local.deadline = at
+
+    def _remaining(self):
+        """Seconds left before the current deadline (None if there is none), raises ApiTimeout if it has passed"""
+        deadline = self._get_deadline()
+        if deadline is None:
+            return None
+        remaining = deadline - now()
+        if remaining <= 0:
+            raise ApiTimeout("Deadline exceeded")
+        return remaining
+
+    def _request_timeout(self):
+        """(connect, read) timeout for the next request, limited by the current deadline"""
+        if isinstance(self.timeout, tuple):
+            connect, read = self.timeout
+        else:
+            connect = read = self.timeout
+        remaining = self._remaining()
+        if remaining is None:
+            return (connect, read)
+        return (remaining if connect is None else min(connect, remaining),
+                remaining if read is None else min(read, remaining))
+
+    def _new_session(self):
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=self.pool_connections, pool_maxsize=self.pool_maxsize)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        session.headers.update({
+            'Content-Type': 'application/json',
+            'Authorization': 'Token %s' % self.key
+        })
+        return session
 
     def _init_session(self):
-        """Iniitializes a requests.Session for us if not already initialized"""
+        """Initializes a requests.Session for us (or this thread) if not already initialized, returns the session"""
+        if self.session_per_thread:
+            session = getattr(self._local, 'session', None)
+            if session is None:
+                session = self._local.session = self._new_session()
+            return session
         if not self.session:
-            self.session = requests.Session()
-            self.session.headers.update({
-                'Content-Type': 'application/json',
-                'Authorization': 'Token %s' % self.key
-            })
-        self.session.remove_expired_responses()
+            with self._session_lock:
+                if not self.session:
+                    self.session = self._new_session()
+        return self.session
 
-    def make_get(self, url, params={}):
-        """Make a GET request"""
-        self._init_session()
-        r = self.session.get(url, params=params)
+    def warmup(self, connections=None):
+        """Opens (up to) connections connections to Holvi so the first requests do not pay for the TLS handshakes
+
+        Defaults to pool_maxsize connections, with session_per_thread only the calling threads session is warmed up."""
+        if connections is None:
+            connections = 1 if self.session_per_thread else self.pool_maxsize
+        session = self._init_session()
+        timeout = self._request_timeout()
+
+        def head():
+            try:
+                session.head(self.base_url_fmt, timeout=timeout)
+            except RequestException:
+                pass  # Warming up is best effort, the real requests will report errors
+
+        threads = [threading.Thread(target=head) for x in range(connections)]
+        for t in threads:
+            t.daemon = True
+            t.start()
+        # The requests may take up to the connect and read timeouts, do not wait for them longer than that
+        end = None if None in timeout else now() + sum(timeout)
+        for t in threads:
+            t.join(None if end is None else max(0, end - now()))
+
+    def _raise_for_status(self, r):
+        """Maps HTTP errors in response r to our exceptions"""
         try:
             r.raise_for_status()
         except Timeout as e:
@@ -59,34 +248,195 @@ class Connection(object):
                 raise AuthenticationError(e.__str__(), response=e.response)  # six.u messes this up
             else:
                 raise ApiError(e.__str__(), response=e.response)  # six.u messes this up
+
+    def stats(self):
+        """Snapshot of the request statistics, see holviapi.stats.Metrics"""
+        return self.metrics.snapshot()
+
+    def _record_attempt(self, method, url, r, started, streamed=False):
+        """Records a single request (attempt) to metrics, the body of streamed responses is not read"""
+        if r is None:
+            self.metrics.record_request(method, url, None, now() - started, 0)
+        elif streamed:
+            self.metrics.record_request(method, url, r.status_code, now() - started,
+                                        int(r.headers.get('Content-Length') or 0))
+        else:
+            self.metrics.record_request(method, url, r.status_code, now() - started, len(r.content))
+
+    def _record_result(self, r, error):
+        """Tells the circuit breaker (if any) how the request went"""
+        if self.circuit_breaker is None:
+            return
+        if error is not None or r.status_code >= 500 or r.status_code == 429:
+            self.circuit_breaker.record_failure()
+        else:
+            self.circuit_breaker.record_success()
+
+    def _raise_for_result(self, r, error):
+        """Raises our exceptions for the final result of a request"""
+        if isinstance(error, Timeout):
+            raise_from(ApiTimeout(error.__str__()), error)  # six.u messes this up
+        if isinstance(error, ConnectionError):
+            raise_from(ApiConnectionError(error.__str__()), error)
+        if error is not None:
+            raise_from(ApiError(error.__str__()), error)
+        self._raise_for_status(r)
+
+    def _send(self, method, url, **kwargs):
+        """Makes the request with retries (see self.retry), returns the response or raises our exceptions"""
+        if self.circuit_breaker is not None:
+            self.circuit_breaker.before_request()
+        attempt = 0
+        try:
+            session = self._init_session()
+            while True:
+                r, error = None, None
+                timeout = self._request_timeout()
+                started = now()
+                try:
+                    r = getattr(session, method)(url, timeout=timeout, **kwargs)
+                except RequestException as e:
+                    error = e
+                self._record_attempt(method, url, r, started, kwargs.get('stream', False))
+                wait = self.retry.get_backoff(method, attempt, r, error)
+                if wait is None:
+                    break
+                try:
+                    remaining = self._remaining()
+                except ApiTimeout:
+                    break  # The deadline passed during the attempt, its result is final
+                if remaining is not None and wait >= remaining:
+                    break
+                if r is not None:
+                    r.close()
+                self.metrics.record_retry(method, url)
+                time.sleep(wait)
+                attempt += 1
+        except BaseException:
+            # The request did not get a result (deadline passed, interrupted or cancelled), this tells nothing about
+            # Holvi but must end the trial request of a half-open circuit
+            if self.circuit_breaker is not None:
+                self.circuit_breaker.release_trial()
+            raise
+        self._record_result(r, error)
+        self._raise_for_result(r, error)
+        return r
+
+    def make_get(self, url, params={}):
+        """Make a GET request, results are cached
+
+        Concurrent calls for the same url and params share a single request"""
+        key = cache_key(url, params)
+        cached = self.cache.get(key)
+        self.metrics.record_cache(url, cached is not None)
+        if cached is not None:
+            return json.loads(cached)
+        while True:
+            with self._inflight_lock:
+                inflight = self._inflight.get(key)
+                if inflight is None:
+                    inflight = self._inflight[key] = _InflightGet()
+                    break
+            body = inflight.wait(self._remaining())
+            if body is not None:
+                return json.loads(body)
+        try:
+            r = self._send('get', url, params=params)
+            self.cache.set(key, r.text)
+            inflight.body = r.text
+        except BaseException as e:
+            inflight.error = e
+            raise
+        finally:
+            with self._inflight_lock:
+                del self._inflight[key]
+            inflight.done.set()
         return r.json()
 
-    def make_post(self, url, payload):
-        """Make a POST request"""
-        return self._make_ppp('post', url, payload)
-
-    def make_put(self, url, payload):
-        """Make a PUT request"""
-        return self._make_ppp('put', url, payload)
-
-    def make_patch(self, url, payload):
-        """Make a PATCH request"""
-        return self._make_ppp('patch', url, payload)
-
-    def _make_ppp(self, method, url, payload):
-        """Internal helper to make POST/PUT/PATCH requests (or whatever the underlying library supports)"""
-        self._init_session()
-        # We can't trust the cache after we have made changes of our own
-        self.session.cache.clear()
-        m = getattr(self.session, method)
-        r = m(url, json=payload)
+    def make_get_streamed(self, url, params={}, key=None):
+        """Make a GET request decoding the response incrementally, returns holviapi.jsonstream.StreamedPage
+
+        For big listings: key is the key of the array in the response object (None if the response is an array),
+        its items are decoded one at a time as they are iterated over. Streamed results are not cached."""
+        r = self._send('get', url, params=params, stream=True)
+        return StreamedPage(r.iter_content(STREAM_CHUNK_SIZE), key, close=r.close)
+
+    def make_get_derived(self, url, name, derive, params={}):
+        """Like make_get but returns derive(result), for example an index of the result
+
+        The derived value is built once per cached response and reused until the response expires, is invalidated or
+        fetched again, so it must not be modified. name identifies derive, use different names for different
+        derived values of the same url."""
+        key = cache_key(url, params)
+        value = self._derived_value(name, key)
+        if value is not None:
+            self.metrics.record_cache(url, True)
+            return value
+        return self._derive(name, key, derive, self.make_get(url, params))
+
+    def _derived_value(self, name, key):
+        """The memoized derived value if it was built from the currently cached response, otherwise None"""
+        memo = self._derived.get((name, key))
+        if memo is None or memo[0] != self.cache.version(key):
+            return None
+        return memo[1]
+
+    def _derive(self, name, key, derive, jsondata):
+        value = derive(jsondata)
+        version = self.cache.version(key)
+        if version is not None:
+            if len(self._derived) >= DERIVED_CACHE_SIZE:
+                self._derived.clear()
+            self._derived[(name, key)] = (version, value)
+        return value
+
+    def make_post(self, url, payload, invalidate=()):
+        """Make a POST request, see _make_ppp for invalidate"""
+        return self._make_ppp('post', url, payload, invalidate)
+
+    def make_put(self, url, payload, invalidate=()):
+        """Make a PUT request, see _make_ppp for invalidate"""
+        return self._make_ppp('put', url, payload, invalidate)
+
+    def make_patch(self, url, payload, invalidate=()):
+        """Make a PATCH request, see _make_ppp for invalidate"""
+        return self._make_ppp('patch', url, payload, invalidate)
+
+    def invalidate(self, url, subtree=False):
+        """Drop cached GET results for url (with any params), if subtree is True also everything below url"""
+        if subtree:
+            self.cache.delete_prefix(url)
+            return
+        self.cache.delete(url)
+        self.cache.delete_prefix(url + '?')
+
+    def cache_put(self, url, data, params=None):
+        """Write data to the cache as the result of GET to url, use for example with the body returned by a mutation"""
+        self.cache.set(cache_key(url, params), json.dumps(data))
+
+    def _invalidate_mutated(self, method, url, invalidate=()):
+        """Drop cached results a mutation to url may have made stale
+
+        That is url itself (and for other than POST everything below it, like status sub-resources), the parent
+        paths (which usually are the lists the resource is in) and any urls listed in invalidate."""
+        self.invalidate(url, subtree=(method != 'post'))
+        parent = url
+        while True:
+            parent = parent.rstrip('/').rsplit('/', 1)[0] + '/'
+            if len(parent) <= len(self.base_url_fmt):
+                break
+            self.invalidate(parent)
+        for extra in invalidate:
+            self.invalidate(extra)
+
+    def _make_ppp(self, method, url, payload, invalidate=()):
+        """Internal helper to make POST/PUT/PATCH requests (or whatever the underlying library supports)
+
+        Cached results for the mutated resource are invalidated (see _invalidate_mutated), pass extra urls whose lists
+        the mutation affects as invalidate."""
         try:
-            r.raise_for_status()
-        except Timeout as e:
-            raise ApiTimeout(e.__str__(), response=e.response)  # six.u messes this up
-        except HTTPError as e:
-            if e.response.status_code in (403, 401):
-                raise AuthenticationError(e.__str__(), response=e.response)  # six.u messes this up
-            else:
-                raise ApiError(e.__str__(), response=e.response)  # six.u messes this up
+            r = self._send(method, url, json=payload)
+        finally:
+            # We can't trust the cache for this resource after we have made changes of our own
+            self._invalidate_mutated(method, url, invalidate)
         return r.json()
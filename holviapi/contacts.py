@@ -5,11 +5,13 @@ import six
 from future.builtins import next, object
 from future.utils import python_2_unicode_compatible, raise_from
 
-from .utils import JSONObject
+from .utils import JSONObject, json_fields
 
 
+@json_fields()
 class InvoiceContact(JSONObject):  # We extend JSONObject instead of HolviObject since there is no direct way to manipulate these
     """Pythonic wrapper for invoice receivers"""
+    __slots__ = ()
     _valid_keys = ("city", "name", "country", "street", "postcode", "email")  # Same for both create and update
 
     def __init__(self, jsondata=None):
@@ -31,8 +33,10 @@ class InvoiceContact(JSONObject):  # We extend JSONObject instead of HolviObject
         return {k: v for (k, v) in self._jsondata.items() if k in self._valid_keys}
 
 
+@json_fields()
 class OrderContact(JSONObject):  # aka buyer
     """Pythonic wrapper for order contact info, aka buyer"""
+    __slots__ = ()
     _valid_keys = ("postcode", "country", "lastname", "country_code", "street", "email", "company", "firstname", "city", "eu_vat_identifier")
 
     def __init__(self, jsondata=None):
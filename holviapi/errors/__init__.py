@@ -2,7 +2,7 @@
 from __future__ import print_function
 from future.builtins import next, object
 from future.utils import python_2_unicode_compatible
-from requests.exceptions import HTTPError, Timeout
+from requests.exceptions import ConnectionError, HTTPError, Timeout
 
 
 @python_2_unicode_compatible
@@ -19,7 +19,11 @@ class ApiError(HTTPError, HolviError):
     def __init__(self, *args, **kwargs):
         super(ApiError, self).__init__(*args, **kwargs)
         if self.response is not None:
-            self.error_details = self.response.json()
+            try:
+                self.error_details = self.response.json()
+            except ValueError:
+                # For example proxies in front of Holvi answer 502/503 with HTML
+                self.error_details = {'body': self.response.text}
 
     def __str__(self, *args, **kwargs):
         return super(ApiError, self).__str__(*args, **kwargs) + " Details: %s" % self.error_details
@@ -35,3 +39,17 @@ class ApiTimeout(ApiError, Timeout):
 
     def __init__(self, *args, **kwargs):
         super(ApiTimeout, self).__init__(*args, **kwargs)
+
+
+class ApiConnectionError(ApiError, ConnectionError):
+    """Raised when connecting to Holvi or reading the response failed (after retries)"""
+
+    def __init__(self, *args, **kwargs):
+        super(ApiConnectionError, self).__init__(*args, **kwargs)
+
+
+class CircuitOpenError(HolviError):
+    """Raised without making a request while the Connection circuit breaker is open"""
+
+    def __init__(self, *args, **kwargs):
+        super(CircuitOpenError, self).__init__(*args, **kwargs)
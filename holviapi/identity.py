@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+
+import threading
+import weakref
+
+from future.builtins import object
+
+
+class IdentityMap(object):
+    """Keeps one shared lazy instance per (class, code) for a Connection
+
+    So that for example all CheckoutItems referring to the same product share one OrderProduct which is loaded only
+    once. Instances are held weakly, they are forgotten when nothing else refers to them."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._objects = weakref.WeakValueDictionary()
+
+    def __len__(self):
+        return len(self._objects)
+
+    def lazy(self, klass, owner, code):
+        """Returns the shared instance of klass for code, creating a lazy one with klass(owner, {"code": code}) if needed"""
+        key = (klass, code)
+        with self._lock:
+            obj = self._objects.get(key)
+            if obj is None:
+                obj = klass(owner, {"code": code})
+                self._objects[key] = obj
+            return obj
+
+    def pending(self, klass):
+        """Lists the shared instances of klass (and its subclasses) that are still lazy"""
+        with self._lock:
+            objects = list(self._objects.items())
+        return [obj for ((k, code), obj) in objects if issubclass(k, klass) and obj._lazy]
+
+    def clear(self):
+        with self._lock:
+            self._objects.clear()
+
+
+def hydrate(pending, by_code):
+    """Loads the lazy instances in pending from by_code (dict of full JSON dicts by code), returns the number loaded
+
+    Instances for codes not in by_code are left lazy."""
+    loaded = 0
+    for obj in pending:
+        jsondata = by_code.get(obj.code)
+        if jsondata is not None and obj._lazy:
+            obj._hydrate(dict(jsondata))
+            loaded += 1
+    return loaded
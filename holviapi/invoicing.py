@@ -8,27 +8,36 @@ import six
 from future.builtins import next, object
 from future.utils import python_2_unicode_compatible, raise_from
 
+from .bulk import map_concurrently
 from .categories import CategoriesAPI, IncomeCategory
+from .columns import invoice_columns
 from .contacts import InvoiceContact
-from .utils import HolviObject, HolviObjectList, JSONObject
+from .errors import HolviError
+from .utils import HolviObject, HolviObjectList, JSONObject, decoded_property, json_fields, parse_date
 
 
+@json_fields("code", "status")
 class Invoice(HolviObject):
     """This represents an invoice in the Holvi system"""
-    items = []
-    issue_date = None
-    due_date = None
-    receiver = None
+    __slots__ = ('_items', '_issue_date', '_due_date', '_receiver')
     _valid_keys = ("currency", "issue_date", "due_date", "items", "receiver", "type", "number", "subject")  # Same for both create and update
     _patch_valid_keys = ("due_date", "issue_date", "subject", "number", "receiver", "items")  # For sent
 
-    def _map_holvi_json_properties(self):
-        self.items = []
-        for item in self._jsondata["items"]:
-            self.items.append(InvoiceItem(self, holvi_dict=item))
-        self.issue_date = datetime.datetime.strptime(self._jsondata["issue_date"], "%Y-%m-%d").date()
-        self.due_date = datetime.datetime.strptime(self._jsondata["due_date"], "%Y-%m-%d").date()
-        self.receiver = InvoiceContact(self._jsondata["receiver"])
+    @decoded_property
+    def items(self):
+        return [InvoiceItem(self, holvi_dict=item) for item in self._jsondata["items"]]
+
+    @decoded_property
+    def issue_date(self):
+        return parse_date(self._jsondata["issue_date"])
+
+    @decoded_property
+    def due_date(self):
+        return parse_date(self._jsondata["due_date"])
+
+    @decoded_property
+    def receiver(self):
+        return InvoiceContact(self._jsondata["receiver"])
 
     def _init_empty(self):
         """Creates the base set of attributes invoice has/needs"""
@@ -51,18 +60,20 @@ class Invoice(HolviObject):
             "items": [],
         }
 
+    def _status_url(self):
+        return self.api._status_url(self.code)
+
     def send(self, send_email=True):
         """Marks the invoice as sent in Holvi
 
         If send_email is False then the invoice is *not* automatically emailed to the recipient
         and your must take care of sending the invoice yourself.
         """
-        url = str(self.api.base_url + '{code}/status/').format(code=self.code)  # six.u messes this up
         payload = {
             'mark_as_sent': True,
             'send_email': send_email,
         }
-        stat = self.api.connection.make_put(url, payload)
+        stat = self.api.connection.make_put(self._status_url(), payload)
         #print("Got stat=%s" % stat)
         # TODO: Check the stat and raise error if daft is not false or active is not true ?
 
@@ -76,8 +87,8 @@ class Invoice(HolviObject):
         self._jsondata["receiver"] = self.receiver.to_holvi_dict()
         return {k: v for (k, v) in self._jsondata.items() if k in self._valid_keys}
 
-    def save(self):
-        """Saves this invoice to Holvi, returns the created/updated invoice"""
+    def _save_request(self):
+        """Validates the invoice and returns (method, url, payload) for saving it"""
         if not self.items:
             raise HolviError("No items")
         if not self.subject:
@@ -90,14 +101,22 @@ class Invoice(HolviObject):
                 send_patch["items"] = []
                 for item in self.items:
                     send_patch["items"].append(item.to_holvi_dict(True))
-                stat = self.api.connection.make_patch(url, send_patch)
-            else:
-                stat = self.api.connection.make_put(url, send_json)
-            return Invoice(self.api, stat)
-        else:
-            url = str(self.api.base_url)
-            stat = self.api.connection.make_post(url, send_json)
-            return Invoice(self.api, stat)
+                return ('patch', url, send_patch)
+            return ('put', url, send_json)
+        return ('post', str(self.api.base_url), send_json)
+
+    def _saved(self, stat):
+        """Handles the Holvi response to save, returns the created/updated invoice"""
+        # Holvi returns the full invoice, no need to fetch it again for get_invoice
+        url = str(self.api.base_url + '{code}/').format(code=stat["code"])
+        self.api.connection.cache_put(url, stat)
+        return Invoice(self.api, stat)
+
+    def save(self):
+        """Saves this invoice to Holvi, returns the created/updated invoice"""
+        method, url, payload = self._save_request()
+        stat = getattr(self.api.connection, 'make_' + method)(url, payload)
+        return self._saved(stat)
 
     def void(self):
         """Mark invoice as void in Holvi"""
@@ -105,31 +124,25 @@ class Invoice(HolviObject):
 
     def delete(self):
         """Mark invoice as void in Holvi"""
-        url = str(self.api.base_url + '{code}/status/').format(code=self.code)  # six.u messes this up
         payload = {
             'void': True,
         }
-        stat = self.api.connection.make_put(url, payload)
+        stat = self.api.connection.make_put(self._status_url(), payload)
         #print("Got stat=%s" % stat)
         # TODO: Check the stat and raise error if active is not what we expected ?
 
 
+@json_fields("code")
 class InvoiceItem(JSONObject):  # We extend JSONObject instead of HolviObject since there is no direct way to manipulate these
     """Pythonic wrapper for the items in an Invoice"""
-    api = None
-    invoice = None
-    category = None
-    net = None
-    gross = None
-    _cklass = IncomeCategory
+    __slots__ = ('api', 'invoice', '_category', 'net', 'gross', '_cklass')
     _valid_keys = ("detailed_price", "category", "description")  # Same for both create and update
     _patch_valid_keys = ("description", "code")
 
     def __init__(self, invoice, holvi_dict={}, cklass=None):
         self.invoice = invoice
         self.api = self.invoice.api
-        if cklass:
-            self._cklass = cklass
+        self._cklass = cklass or IncomeCategory
         super(InvoiceItem, self).__init__(**holvi_dict)
         self._map_holvi_json_properties()
 
@@ -138,11 +151,15 @@ class InvoiceItem(JSONObject):  # We extend JSONObject instead of HolviObject si
             self._jsondata["detailed_price"] = {"net": "0.00", "gross": "0.00"}
         self.net = Decimal(self._jsondata["detailed_price"].get("net"))
         self.gross = Decimal(self._jsondata["detailed_price"].get("gross"))
-        if self._jsondata.get("category"):
-            self.category = self._cklass(self.api.categories_api, {"code": self._jsondata["category"]})
         # PONDER: there is a 'product' key in the Holvi JSON for items but it's always None
         #         and the web UI does not allow setting products to invoices
 
+    @decoded_property
+    def category(self):
+        if not self._jsondata.get("category"):
+            return None
+        return self.api.connection.identity_map.lazy(self._cklass, self.api.categories_api, self._jsondata["category"])
+
     def to_holvi_dict(self, patch=False):
         if not self.gross:
             self.gross = self.net
@@ -169,12 +186,27 @@ class InvoiceList(HolviObjectList):
     _klass = Invoice
 
     def _get_size(self):
+        if self.streamed:
+            self.size = None  # Not known until the whole array has been read
+            return
         self.size = len(self.jsondata["list"])
 
     def _get_iter(self):
+        if self.streamed:
+            self._iter = iter(self.jsondata)
+            return
         self.jsondata = {"next": None, "list": self.jsondata}
         self._iter = iter(self.jsondata["list"])
 
+    def to_columns(self):
+        """Exports the (remaining) invoices as columns without creating Invoice objects, returns dict of columns
+
+        There is a row for each invoice item: code and status of the invoice, category code of the item, net and
+        gross of the item in integer cents and create_time and paid_time of the invoice in seconds since epoch
+        (holviapi.columns.MISSING if not set), see holviapi.columns for the column types.
+        Combine with stream=True of InvoiceAPI.list_invoices() to keep only the columns in memory."""
+        return invoice_columns(self._iter_jsondata())
+
 
 @python_2_unicode_compatible
 class InvoiceAPI(object):
@@ -205,7 +237,12 @@ class InvoiceAPI(object):
         All times are ISO datetimes, try for example '2016-01-20T00:00:00.0Z'.
 
         For other kinds of filtering use Pythons filter() function as usual.
+
+        Pass stream=True to decode the response incrementally while iterating so only one invoice is in memory at a
+        time, streamed results are not cached and len() of the list is not available.
         """
+        if kwargs.pop('stream', False):
+            return InvoiceList(self.connection.make_get_streamed(self.base_url, params=kwargs), self)
         invoices = self.connection.make_get(self.base_url, params=kwargs)
         return InvoiceList(invoices, self)
 
@@ -215,3 +252,78 @@ class InvoiceAPI(object):
         ijson = self.connection.make_get(url)
         #print("Got ijson=%s" % ijson)
         return Invoice(self, ijson)
+
+    def _status_url(self, code):
+        return str(self.base_url + '{code}/status/').format(code=code)  # six.u messes this up
+
+    @staticmethod
+    def _unique_codes(invoices):
+        """Unique codes of invoices (Invoice objects or codes) in order"""
+        codes = []
+        seen = set()
+        for invoice in invoices:
+            code = invoice if isinstance(invoice, six.string_types) else invoice.code
+            if code not in seen:
+                seen.add(code)
+                codes.append(code)
+        return codes
+
+    def _update_status_many(self, invoices, payload, concurrency, rate):
+        codes = self._unique_codes(invoices)
+        deadline = self.connection._get_deadline()
+
+        def update(code):
+            with self.connection.deadline_at(deadline):
+                return self.connection.make_put(self._status_url(code), payload)
+
+        return dict(zip(codes, map_concurrently(update, codes, concurrency, rate)))
+
+    def send_many(self, invoices, send_email=True, concurrency=4, rate=None):
+        """Marks invoices (Invoice objects or codes) as sent in Holvi, see Invoice.send
+
+        Up to concurrency requests are made at a time, rate limits them per second (None for no limit, pass a
+        holviapi.bulk.RateLimiter to share a limit between batches). Returns dict of code to the Holvi response or
+        the error (HolviError or requests exception)."""
+        payload = {
+            'mark_as_sent': True,
+            'send_email': send_email,
+        }
+        return self._update_status_many(invoices, payload, concurrency, rate)
+
+    def void_many(self, invoices, concurrency=4, rate=None):
+        """Marks invoices (Invoice objects or codes) as void in Holvi, see send_many"""
+        return self._update_status_many(invoices, {'void': True}, concurrency, rate)
+
+    def _prepare_create(self, invoice):
+        """Validates invoice for create_many, returns (invoice, url, payload) or the HolviError"""
+        try:
+            method, url, payload = invoice._save_request()
+        except HolviError as e:
+            return e
+        if method != 'post':
+            return HolviError("Invoice %s already exists" % invoice.code)
+        return (invoice, url, payload)
+
+    def create_many(self, invoices, concurrency=4):
+        """Creates new invoices in Holvi posting up to concurrency of them at a time
+
+        Returns a list with the created Invoice or the error (HolviError or requests exception) for each of
+        invoices in the same order. All invoices are validated before posting anything, invalid ones are not posted.
+        Give the Connection pool_maxsize of at least concurrency."""
+        prepared = [self._prepare_create(invoice) for invoice in invoices]
+        deadline = self.connection._get_deadline()
+
+        def create(request):
+            if isinstance(request, HolviError):
+                return request
+            invoice, url, payload = request
+            # The deadline of the caller applies in the worker threads too
+            with self.connection.deadline_at(deadline):
+                r = self.connection._send('post', url, json=payload)
+            return invoice._saved(r.json())
+
+        try:
+            return map_concurrently(create, prepared, concurrency)
+        finally:
+            # Once for the whole batch instead of after each post
+            self.connection._invalidate_mutated('post', self.base_url)
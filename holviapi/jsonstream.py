@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+
+import codecs
+import json
+import re
+
+import six
+from future.builtins import object
+
+WHITESPACE = re.compile(r'[ \t\n\r]*')
+# Characters that may continue a number raw_decode stopped before (like '12.' + '5' or '1e' + '5')
+NUMBER_CONTINUES = frozenset('0123456789.eE+-')
+
+
+class StreamedPage(object):
+    """Decodes a JSON response body incrementally from an iterable of byte chunks
+
+    The body is either an array (key is None) or an object whose value for key is an array, iterating over the
+    array (page[key] or iter(page) when key is None) yields its items one at a time so only the item being decoded
+    is held in memory. The items can be iterated only once.
+
+    The other values of the object are available like in a dict, values before the array are read when asked
+    for and the values after it once the array has been iterated over."""
+
+    def __init__(self, chunks, key=None, close=None):
+        """close is called when the whole body has been read or close() is called"""
+        self.key = key
+        self._chunks = iter(chunks)
+        self._close = close
+        self._decoder = codecs.getincrementaldecoder('utf-8')()
+        self._json = json.JSONDecoder()
+        self._buf = ''
+        self._pos = 0
+        self._eof = False
+        self._values = {}
+        self._state = 'start'  # start -> array (positioned at the first item) -> items -> done
+
+    def _fill(self):
+        """Reads more of the body to the buffer (dropping what has been decoded), returns False at the end"""
+        if self._eof:
+            return False
+        for chunk in self._chunks:
+            text = self._decoder.decode(chunk)
+            if text:
+                self._buf = self._buf[self._pos:] + text
+                self._pos = 0
+                return True
+        self._buf = self._buf[self._pos:] + self._decoder.decode(b'', True)
+        self._pos = 0
+        self._eof = True
+        return False
+
+    def _peek(self):
+        """Skips whitespace, returns the next character or '' at the end of the body"""
+        while True:
+            self._pos = WHITESPACE.match(self._buf, self._pos).end()
+            if self._pos < len(self._buf):
+                return self._buf[self._pos]
+            if not self._fill():
+                return ''
+
+    def _expect(self, chars):
+        """Consumes the next character which must be one of chars, returns it"""
+        c = self._peek()
+        if not c or c not in chars:
+            raise ValueError("Expecting one of %r, got %r" % (chars, self._buf[self._pos:self._pos + 20]))
+        self._pos += 1
+        return c
+
+    def _value(self):
+        """Decodes the next complete JSON value"""
+        self._peek()
+        while True:
+            try:
+                value, end = self._json.raw_decode(self._buf, self._pos)
+            except ValueError:
+                if self._eof:
+                    raise
+            else:
+                # A number at the end of the buffer, or cut at '.' or the exponent, may continue in the next chunk
+                if (self._eof or not isinstance(value, (float,) + six.integer_types) or
+                        (end < len(self._buf) and self._buf[end] not in NUMBER_CONTINUES)):
+                    self._pos = end
+                    return value
+            self._fill()
+
+    def _read_members(self, stop=None):
+        """Reads members of the top-level object to self._values until member stop, returns True if stopped there
+
+        When stopped the position is at the first item of the array value of stop."""
+        while True:
+            c = self._peek()
+            if c == '}':
+                self._pos += 1
+                self._finish()
+                return False
+            if c == ',':
+                self._pos += 1
+            name = self._value()
+            self._expect(':')
+            if name == stop:
+                self._expect('[')
+                return True
+            self._values[name] = self._value()
+
+    def _seek_array(self):
+        if self._state != 'start':
+            return
+        if self.key is None:
+            self._expect('[')
+            self._state = 'array'
+            return
+        self._expect('{')
+        if self._read_members(self.key):
+            self._state = 'array'
+
+    def _finish(self):
+        self._state = 'done'
+        self.close()
+
+    def items(self):
+        """Yields the items of the array"""
+        self._seek_array()
+        if self._state != 'array':
+            if self._state != 'done':
+                raise ValueError("Streamed items can be iterated only once")
+            return
+        self._state = 'items'
+        if self._peek() == ']':
+            self._pos += 1
+        else:
+            while True:
+                yield self._value()
+                if self._expect(',]') == ']':
+                    break
+        if self.key is None:
+            self._finish()
+        else:
+            self._read_members()
+
+    def __iter__(self):
+        return self.items()
+
+    def get(self, name, default=None):
+        if name == self.key:
+            return self.items()
+        if name not in self._values:
+            self._seek_array()
+        return self._values.get(name, default)
+
+    def __getitem__(self, name):
+        value = self.get(name, KeyError)
+        if value is KeyError:
+            raise KeyError(name)
+        return value
+
+    def __contains__(self, name):
+        return self.get(name, KeyError) is not KeyError
+
+    def close(self):
+        """Releases the underlying response, call if you stop iterating before the end"""
+        if self._close is not None:
+            self._close()
+            self._close = None
@@ -0,0 +1,246 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+
+import calendar
+import contextlib
+import datetime
+import json
+import sqlite3
+import threading
+
+from future.builtins import object
+
+from .checkout import CheckoutAPI, Order
+from .columns import MISSING, to_epoch
+from .invoicing import Invoice, InvoiceAPI
+from .sync import DeltaSync
+
+# Bumped when the tables change, older mirrors are dropped and filled again by the next sync
+SCHEMA_VERSION = 2
+TABLES = ('invoices', 'invoice_categories', 'orders', 'order_products', 'marks')
+SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS invoices (pool TEXT, code TEXT, status TEXT, email TEXT, name TEXT,"
+    " create_time INTEGER, paid_time INTEGER, update_time INTEGER, json TEXT, PRIMARY KEY (pool, code))",
+    "CREATE INDEX IF NOT EXISTS invoices_status ON invoices (pool, status)",
+    "CREATE INDEX IF NOT EXISTS invoices_email ON invoices (pool, email)",
+    "CREATE INDEX IF NOT EXISTS invoices_create_time ON invoices (pool, create_time)",
+    "CREATE INDEX IF NOT EXISTS invoices_paid_time ON invoices (pool, paid_time)",
+    "CREATE TABLE IF NOT EXISTS invoice_categories (pool TEXT, code TEXT, category TEXT,"
+    " PRIMARY KEY (pool, category, code))",
+    "CREATE INDEX IF NOT EXISTS invoice_categories_code ON invoice_categories (pool, code)",
+    "CREATE TABLE IF NOT EXISTS orders (pool TEXT, code TEXT, status TEXT, email TEXT,"
+    " create_time INTEGER, paid_time INTEGER, update_time INTEGER, json TEXT, PRIMARY KEY (pool, code))",
+    "CREATE INDEX IF NOT EXISTS orders_status ON orders (pool, status)",
+    "CREATE INDEX IF NOT EXISTS orders_email ON orders (pool, email)",
+    "CREATE INDEX IF NOT EXISTS orders_create_time ON orders (pool, create_time)",
+    "CREATE INDEX IF NOT EXISTS orders_paid_time ON orders (pool, paid_time)",
+    "CREATE TABLE IF NOT EXISTS order_products (pool TEXT, code TEXT, product TEXT,"
+    " PRIMARY KEY (pool, product, code))",
+    "CREATE INDEX IF NOT EXISTS order_products_code ON order_products (pool, code)",
+    "CREATE TABLE IF NOT EXISTS marks (key TEXT PRIMARY KEY, state TEXT)",
+)
+
+
+def _epoch(value):
+    """Seconds since epoch for datetime, date or ISO 8601 string, None if not set"""
+    if isinstance(value, datetime.datetime):
+        return calendar.timegm(value.utctimetuple())
+    if isinstance(value, datetime.date):
+        return calendar.timegm(value.timetuple())
+    value = to_epoch(value)
+    if value == MISSING:
+        return None
+    return value
+
+
+def _lower(value):
+    return value.lower() if value else value
+
+
+class Mirror(object):
+    """Local copy of the invoices and orders of a pool in a SQLite database, for queries Holvi cannot do
+
+    Keep it up to date with sync() (or pass upsert to DeltaSync yourself), the raw JSON is stored and queries
+    return normal Invoice and Order objects. Status, receiver/buyer email, category, product and the create
+    and paid times are indexed. The Mirror is also a mark store for DeltaSync.
+    Mirrors of different pools (the pool of connection) can share the same database file."""
+
+    def __init__(self, connection, path='holvi_mirror.sqlite'):
+        self.connection = connection
+        self.path = path
+        self.invoices_api = InvoiceAPI(connection)
+        self.checkout_api = CheckoutAPI(connection)
+        self._lock = threading.RLock()
+        self._depth = 0
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        with self.transaction():
+            if self._db.execute("PRAGMA user_version").fetchone()[0] != SCHEMA_VERSION:
+                for table in TABLES:
+                    self._db.execute("DROP TABLE IF EXISTS %s" % table)
+                self._db.execute("PRAGMA user_version = %d" % SCHEMA_VERSION)
+            for statement in SCHEMA:
+                self._db.execute(statement)
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """Groups the writes in the block to one transaction, can be nested"""
+        with self._lock:
+            if self._depth == 0:
+                self._db.execute("BEGIN")
+            self._depth += 1
+            try:
+                yield
+            except BaseException:
+                self._depth -= 1
+                if self._depth == 0:
+                    self._db.execute("ROLLBACK")
+                raise
+            self._depth -= 1
+            if self._depth == 0:
+                self._db.execute("COMMIT")
+
+    def get(self, key):
+        """DeltaSync mark store interface"""
+        with self._lock:
+            row = self._db.execute("SELECT state FROM marks WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set(self, key, state):
+        """DeltaSync mark store interface"""
+        with self.transaction():
+            self._db.execute("INSERT OR REPLACE INTO marks (key, state) VALUES (?, ?)", (key, json.dumps(state)))
+
+    def sync(self, full=False, overlap=300):
+        """Fetches the invoices and orders changed since the previous sync (see DeltaSync), returns their results"""
+        sync = DeltaSync(self.connection, marks=self, overlap=overlap)
+        return {
+            'invoices': sync.sync_invoices(self.upsert_invoice, full),
+            'orders': sync.sync_orders(self.upsert_order, full),
+        }
+
+    def upsert(self, obj):
+        """Stores Invoice or Order obj (replacing the previous version)"""
+        if isinstance(obj, Invoice):
+            return self.upsert_invoice(obj)
+        if isinstance(obj, Order):
+            return self.upsert_order(obj)
+        raise TypeError("Cannot mirror %s" % obj.__class__.__name__)
+
+    def upsert_invoice(self, invoice):
+        data = invoice._jsondata
+        pool, code = self.connection.pool, data["code"]
+        receiver = data.get("receiver") or {}
+        categories = set(item["category"] for item in data.get("items") or () if item.get("category"))
+        with self.transaction():
+            self._db.execute(
+                "INSERT OR REPLACE INTO invoices"
+                " (pool, code, status, email, name, create_time, paid_time, update_time, json)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (pool, code, data.get("status"), _lower(receiver.get("email")), receiver.get("name"),
+                 _epoch(data.get("create_time")), _epoch(data.get("paid_time")), _epoch(data.get("update_time")),
+                 json.dumps(data)))
+            self._db.execute("DELETE FROM invoice_categories WHERE pool = ? AND code = ?", (pool, code))
+            self._db.executemany("INSERT INTO invoice_categories (pool, code, category) VALUES (?, ?, ?)",
+                                 [(pool, code, category) for category in categories])
+
+    def upsert_order(self, order):
+        data = order._jsondata
+        pool, code = self.connection.pool, data["code"]
+        products = set(purchase["product"] for purchase in data.get("purchases") or () if purchase.get("product"))
+        with self.transaction():
+            self._db.execute(
+                "INSERT OR REPLACE INTO orders (pool, code, status, email, create_time, paid_time, update_time, json)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (pool, code, data.get("status"), _lower(data.get("email")), _epoch(data.get("create_time")),
+                 _epoch(data.get("paid_time")), _epoch(data.get("update_time")), json.dumps(data)))
+            self._db.execute("DELETE FROM order_products WHERE pool = ? AND code = ?", (pool, code))
+            self._db.executemany("INSERT INTO order_products (pool, code, product) VALUES (?, ?, ?)",
+                                 [(pool, code, product) for product in products])
+
+    def delete_invoice(self, code):
+        with self.transaction():
+            self._db.execute("DELETE FROM invoices WHERE pool = ? AND code = ?", (self.connection.pool, code))
+            self._db.execute("DELETE FROM invoice_categories WHERE pool = ? AND code = ?", (self.connection.pool, code))
+
+    def delete_order(self, code):
+        with self.transaction():
+            self._db.execute("DELETE FROM orders WHERE pool = ? AND code = ?", (self.connection.pool, code))
+            self._db.execute("DELETE FROM order_products WHERE pool = ? AND code = ?", (self.connection.pool, code))
+
+    def _query(self, table, where, args, limit):
+        sql = "SELECT json FROM %s WHERE " % table + " AND ".join(["pool = ?"] + where)
+        args = [self.connection.pool] + args
+        sql += " ORDER BY create_time DESC"
+        if limit is not None:
+            sql += " LIMIT %d" % limit
+        with self._lock:
+            return [json.loads(row[0]) for row in self._db.execute(sql, args)]
+
+    @staticmethod
+    def _time_filters(where, args, column, start, end):
+        if start is not None:
+            where.append("%s >= ?" % column)
+            args.append(_epoch(start))
+        if end is not None:
+            where.append("%s <= ?" % column)
+            args.append(_epoch(end))
+
+    @staticmethod
+    def _paid_filter(where, paid):
+        if paid is not None:
+            where.append("paid_time IS NOT NULL" if paid else "paid_time IS NULL")
+
+    def query_invoices(self, status=None, email=None, receiver=None, category=None, paid=None, created_from=None,
+                       created_to=None, paid_from=None, paid_to=None, limit=None):
+        """Finds mirrored invoices, returns list of Invoice newest first
+
+        email is the receivers email (case insensitive), receiver part of the receivers name (not indexed),
+        category a category code, paid True/False for invoices with/without paid_time and the times are
+        datetimes, dates or ISO 8601 strings (inclusive)."""
+        where, args = [], []
+        if status is not None:
+            where.append("status = ?")
+            args.append(status)
+        if email is not None:
+            where.append("email = ?")
+            args.append(email.lower())
+        if receiver is not None:
+            where.append("name LIKE ?")
+            args.append('%' + receiver + '%')
+        if category is not None:
+            where.append("code IN (SELECT code FROM invoice_categories WHERE pool = ? AND category = ?)")
+            args.extend((self.connection.pool, category))
+        self._paid_filter(where, paid)
+        self._time_filters(where, args, 'create_time', created_from, created_to)
+        self._time_filters(where, args, 'paid_time', paid_from, paid_to)
+        return [Invoice(self.invoices_api, data) for data in self._query('invoices', where, args, limit)]
+
+    def query_orders(self, status=None, email=None, product=None, paid=None, created_from=None, created_to=None,
+                     paid_from=None, paid_to=None, limit=None):
+        """Finds mirrored orders, returns list of Order newest first, see query_invoices
+
+        For example all unpaid orders of a buyer: query_orders(email='buyer@example.com', paid=False)"""
+        where, args = [], []
+        if status is not None:
+            where.append("status = ?")
+            args.append(status)
+        if email is not None:
+            where.append("email = ?")
+            args.append(email.lower())
+        if product is not None:
+            where.append("code IN (SELECT code FROM order_products WHERE pool = ? AND product = ?)")
+            args.extend((self.connection.pool, product))
+        self._paid_filter(where, paid)
+        self._time_filters(where, args, 'create_time', created_from, created_to)
+        self._time_filters(where, args, 'paid_time', paid_from, paid_to)
+        return [Order(self.checkout_api, data) for data in self._query('orders', where, args, limit)]
+
+    def get_invoice(self, code):
+        """Mirrored Invoice with code or None"""
+        found = self._query('invoices', ["code = ?"], [code], 1)
+        return Invoice(self.invoices_api, found[0]) if found else None
+
+    def get_order(self, code):
+        """Mirrored Order with code or None"""
+        found = self._query('orders', ["code = ?"], [code], 1)
+        return Order(self.checkout_api, found[0]) if found else None
@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+
+import json
+import logging
+import threading
+
+from future.builtins import object
+from six.moves.urllib.parse import parse_qs
+
+from .bulk import ITEM_ERRORS
+
+logger = logging.getLogger(__name__)
+
+# Where the order code is looked for in the notification request (query string, form or JSON body)
+CODE_KEYS = ('code', 'order_code', 'order')
+
+
+def code_from_request(query_string, body=b'', content_type=''):
+    """Extracts the order code from a notification request, None if not found
+
+    The code may be in the query string (so it can be part of the notification_url), a form or a JSON body
+    (also the details_uri of the order is understood)."""
+    values = parse_qs(query_string or '')
+    if body:
+        if content_type.startswith('application/json'):
+            try:
+                data = json.loads(body.decode('utf-8'))
+            except ValueError:
+                data = None
+            if isinstance(data, dict):
+                values.update({k: [v] for (k, v) in data.items() if v})
+                if data.get('details_uri'):
+                    values.setdefault('code', [data['details_uri'].rstrip('/').rsplit('/', 1)[-1]])
+        else:
+            values.update(parse_qs(body.decode('utf-8')))
+    for key in CODE_KEYS:
+        if values.get(key):
+            return values[key][0]
+    return None
+
+
+class NotificationReceiver(object):
+    """Keeps the cache (and optionally a holviapi.mirror.Mirror) up to date when Holvi calls notification_url
+
+    Call notify(order_code) from your web framework, or mount wsgi_app as WSGI application. The notification is
+    not trusted beyond the order code: the cached get_order response and the order listings are invalidated
+    right away and the order is fetched again from Holvi, passed to mirror.upsert() and on_update(order).
+    Notifications for the same order within debounce seconds are handled with one fetch, made debounce seconds
+    after the first one (0 fetches in notify() itself). Errors fetching the order are passed to
+    on_error(order_code, exception). Failed debounced refreshes are logged and tried again up to retries times."""
+
+    def __init__(self, checkout_api, mirror=None, debounce=2.0, on_update=None, on_error=None, retries=3):
+        self.checkout_api = checkout_api
+        self.mirror = mirror
+        self.debounce = debounce
+        self.on_update = on_update
+        self.on_error = on_error
+        self.retries = retries
+        self._pending = {}
+        self._running = set()
+        self._closed = False
+        self._lock = threading.Lock()
+
+    def notify(self, order_code):
+        """Handles a notification about order_code"""
+        self.checkout_api.invalidate_order(order_code)
+        if not self.debounce:
+            self._refresh(order_code)
+            return
+        self._schedule(order_code, 0)
+
+    def _schedule(self, order_code, attempt):
+        with self._lock:
+            if order_code in self._pending:
+                return
+            timer = self._pending[order_code] = threading.Timer(self.debounce, self._fire)
+            timer.args = (order_code, timer, attempt)
+            timer.daemon = True
+        timer.start()
+
+    def _fire(self, order_code, timer, attempt):
+        with self._lock:
+            # flush() or close() may have taken the notification while the timer was firing
+            if self._pending.get(order_code) is not timer:
+                return
+            del self._pending[order_code]
+            self._running.add(timer)
+        try:
+            self._refresh_or_retry(order_code, attempt)
+        finally:
+            with self._lock:
+                self._running.discard(timer)
+
+    def _refresh_or_retry(self, order_code, attempt):
+        """Refreshes order_code catching all errors, schedules another try if it fails"""
+        try:
+            if self._refresh(order_code):
+                return
+        except Exception:
+            logger.exception("Refreshing order %s failed", order_code)
+        if self._closed or attempt >= self.retries:
+            logger.error("Giving up refreshing order %s after %d tries", order_code, attempt + 1)
+            return
+        self._schedule(order_code, attempt + 1)
+
+    def _refresh(self, order_code):
+        """Fetches order_code again and passes it on, returns False if fetching it failed"""
+        try:
+            # Notifications may arrive while we are fetching, do not let one of them serve us a stale response
+            self.checkout_api.invalidate_order(order_code)
+            order = self.checkout_api.get_order(order_code)
+        except ITEM_ERRORS as e:
+            if self.on_error is not None:
+                self.on_error(order_code, e)
+            return False
+        if self.mirror is not None:
+            self.mirror.upsert(order)
+        if self.on_update is not None:
+            self.on_update(order)
+        return True
+
+    def flush(self):
+        """Handles the pending (debounced) notifications now, and waits for the ones already being handled"""
+        with self._lock:
+            pending = list(self._pending.values())
+            self._pending.clear()
+            running = [timer for timer in self._running if timer is not threading.current_thread()]
+        for timer in pending:
+            timer.cancel()
+        for timer in pending:
+            order_code, _, attempt = timer.args
+            self._refresh_or_retry(order_code, attempt)
+        for timer in running:
+            timer.join()
+
+    def close(self):
+        """Drops the pending notifications, failed refreshes are not tried again"""
+        with self._lock:
+            self._closed = True
+            pending = list(self._pending.values())
+            self._pending.clear()
+        for timer in pending:
+            timer.cancel()
+
+    def wsgi_app(self, environ, start_response):
+        """WSGI application receiving the notifications, answers 400 if no order code is found"""
+        try:
+            length = int(environ.get('CONTENT_LENGTH') or 0)
+        except ValueError:
+            length = 0
+        body = environ['wsgi.input'].read(length) if length else b''
+        order_code = code_from_request(environ.get('QUERY_STRING', ''), body, environ.get('CONTENT_TYPE', ''))
+        if not order_code:
+            start_response('400 Bad Request', [('Content-Type', 'text/plain')])
+            return [b'No order code']
+        self.notify(order_code)
+        start_response('200 OK', [('Content-Type', 'text/plain')])
+        return [b'OK']
@@ -1,32 +1,44 @@
 # -*- coding: utf-8 -*-
 from __future__ import print_function
 
-from future.builtins import next, object
-from future.builtins.iterators import filter
+from future.builtins import object
 from future.utils import python_2_unicode_compatible, raise_from
 
 from .categories import CategoriesAPI, IncomeCategory
+from .identity import hydrate
 from .utils import HolviObject, HolviObjectList, JSONObject
 
 
+def index_products(obdata):
+    """Indexes the products of openbudget response and their questions by code, returns (products, questions)"""
+    products = {}
+    questions = {}
+    for pdata in obdata["products"]:
+        products[pdata["code"]] = pdata
+        for qdata in pdata.get("questions", []):
+            questions[qdata["code"]] = qdata
+    return (products, questions)
+
+
 @python_2_unicode_compatible
 class Product(HolviObject):
     """This represents a product in the Holvi system"""
-    api = None
     category = None
     questions = []
     _cklass = IncomeCategory
+    _questions_index = None
+    _batch_resolved = True
     _valid_keys = ["code", "name", "description", "questions"]  # Not really, there is no API for managing products ATM
 
     def __init__(self, api, jsondata=None, cklass=None, **kwargs):
         if cklass:
             self._cklass = cklass
-        self._fetch_method = api.get_product
-        super(Product, self).__init__(api, jsondata, **kwargs)
+        super(Product, self).__init__(api, jsondata, fetch_method=api.get_product, **kwargs)
 
     def _map_holvi_json_properties(self):
         if self._jsondata.get("category"):
-            self.category = self._cklass(self.api.categories_api, {"code": self._jsondata["category"]})
+            self.category = self.api.connection.identity_map.lazy(self._cklass, self.api.categories_api,
+                                                                  self._jsondata["category"])
         self.questions = []
         # If we're lazy-loaded we don't have this array
         for qdata in self._jsondata.get("questions", []):
@@ -42,13 +54,15 @@ class Product(HolviObject):
         return filtered
 
     def get_question(self, code):
+        """Gets question with given code, None if this product has no such question"""
         if self._lazy:
             # Trigger full fetch
             self.name
-        candidates = filter(lambda c: c.code == code, self.questions)
-        if not candidates:
-            return None
-        return next(candidates)
+        # The index is rebuilt if questions has been replaced or added to
+        index = self._questions_index
+        if index is None or index[0] is not self.questions or index[1] != len(self.questions):
+            index = self._questions_index = (self.questions, len(self.questions), {q.code: q for q in self.questions})
+        return index[2].get(code)
 
 
 class ShopProduct(Product):
@@ -64,18 +78,18 @@ class OrderProduct(Product):
 class ProductQuestion(HolviObject):  # We extend HolviObject even though there is no direct way to manipulate these, for lazy-loading support
     product = None
     _pklass = OrderProduct
+    _batch_resolved = True
     _valid_keys = ("active", "product", "label", "code", "helptext")
 
     def __init__(self, product, holvi_dict={}, pklass=None):
         self.product = product
         if pklass:
             self._pklass = pklass
-        self._fetch_method = self.product.get_question
-        super(ProductQuestion, self).__init__(self.product.api, holvi_dict)
+        super(ProductQuestion, self).__init__(self.product.api, holvi_dict, fetch_method=self.product.get_question)
 
     def _map_holvi_json_properties(self):
         if self._jsondata.get("product"):
-            self.product = self._pklass(self.api, {"code": self._jsondata["product"]})
+            self.product = self.api.connection.identity_map.lazy(self._pklass, self.api, self._jsondata["product"])
 
     def to_holvi_dict(self):
         if self.product:
@@ -116,10 +130,32 @@ class ProductsAPI(object):
         return ProductList(obdata, self)
 
     def get_product(self, code):
-        """Gets product with given code
+        """Gets product with given code, None if there is no such product
+
+        NOTE: Looks the product up in this end due to API limitations, from an index of the open budget data that is
+        built once per response (see Connection.make_get_derived)"""
+        products, questions = self.connection.make_get_derived(self.base_url, 'products', index_products)
+        return self._product(products, code)
 
-        NOTE: Filters the list of products in this end due to API limitations"""
-        candidates = list(filter(lambda c: c.code == code, self.list_products()))
-        if not len(candidates):
+    def _product(self, products, code):
+        pdata = products.get(code)
+        if pdata is None:
             return None
-        return candidates[0]
+        return ShopProduct(self, dict(pdata))
+
+    def resolve_references(self):
+        """Loads all lazy products and product questions of the connection (see Connection.identity_map) with one
+        openbudget fetch, returns the number of objects loaded
+
+        Lazy-loading any of them calls this, so the products (and questions) of all items decoded so far are
+        fetched once instead of once per item."""
+        products = self.connection.identity_map.pending(Product)
+        questions = self.connection.identity_map.pending(ProductQuestion)
+        if not products and not questions:
+            return 0
+        index = self.connection.make_get_derived(self.base_url, 'products', index_products)
+        return self._hydrate_references(index, products, questions)
+
+    @staticmethod
+    def _hydrate_references(index, products, questions):
+        return hydrate(products, index[0]) + hydrate(questions, index[1])
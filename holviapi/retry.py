@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+
+import email.utils
+import random
+import threading
+import time
+
+from future.builtins import object
+
+from .errors import CircuitOpenError
+
+
+class RetryPolicy(object):
+    """Decides which failed requests Connection retries and how long it waits in between
+
+    By default only GETs are retried (on connection errors, timeouts and the statuses in status_forcelist), add 'put'
+    to methods if your PUTs are safe to repeat. 429 Too Many Requests is retried for all methods since Holvi did not
+    process the request.
+    Waits are exponential with full jitter, a Retry-After header from Holvi is honoured when present (the request is
+    not retried if it asks for more than max_backoff or the deadline would pass first)."""
+
+    def __init__(self, total=3, backoff_factor=0.5, max_backoff=30, status_forcelist=(429, 500, 502, 503, 504),
+                 methods=('get',), respect_retry_after=True):
+        self.total = total
+        self.backoff_factor = backoff_factor
+        self.max_backoff = max_backoff
+        self.status_forcelist = status_forcelist
+        self.methods = methods
+        self.respect_retry_after = respect_retry_after
+
+    def is_retryable(self, method, response=None, error=None):
+        """Is the result (response or the exception raised instead) of method worth retrying"""
+        if response is not None and response.status_code == 429:
+            return True
+        if method.lower() not in self.methods:
+            return False
+        if error is not None:
+            return True
+        return response is not None and response.status_code in self.status_forcelist
+
+    def retry_after(self, response):
+        """Seconds the Retry-After header of response asks us to wait, None if not given"""
+        if response is None or not self.respect_retry_after:
+            return None
+        value = response.headers.get('Retry-After')
+        if not value:
+            return None
+        try:
+            return max(0, float(value))
+        except ValueError:
+            parsed = email.utils.parsedate_tz(value)
+            if parsed is None:
+                return None
+            return max(0, email.utils.mktime_tz(parsed) - time.time())
+
+    def backoff(self, attempt, response=None):
+        """Seconds to wait before retry number attempt (starting from 0), None if Retry-After asks for more than
+        max_backoff"""
+        wait = self.retry_after(response)
+        if wait is not None:
+            return wait if wait <= self.max_backoff else None
+        return random.uniform(0, min(self.max_backoff, self.backoff_factor * (2 ** attempt)))
+
+    def get_backoff(self, method, attempt, response=None, error=None):
+        """Seconds to wait before retrying, or None if we should not retry
+
+        The caller must still check the wait fits in its deadline."""
+        if attempt >= self.total or not self.is_retryable(method, response, error):
+            return None
+        return self.backoff(attempt, response)
+
+
+class NoRetry(RetryPolicy):
+    """Never retries"""
+
+    def __init__(self):
+        super(NoRetry, self).__init__(total=0)
+
+
+class CircuitBreaker(object):
+    """Fails fast with CircuitOpenError after failure_threshold consecutive failures
+
+    After reset_timeout seconds one trial request is let through, if it succeeds the circuit closes again."""
+
+    def __init__(self, failure_threshold=5, reset_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._trial = False
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self):
+        return self.opened_at is not None
+
+    def before_request(self):
+        """Raises CircuitOpenError unless the request may go through"""
+        with self._lock:
+            if self.opened_at is None:
+                return
+            if not self._trial and time.time() - self.opened_at >= self.reset_timeout:
+                self._trial = True
+                return
+            raise CircuitOpenError("Holvi API failed %d times in a row, not trying again before %.1fs has passed" % (
+                self.failures, self.reset_timeout))
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial = False
+
+    def release_trial(self):
+        """Ends the trial request without a result, for requests that failed before or without reaching Holvi"""
+        with self._lock:
+            self._trial = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self._trial or self.failures >= self.failure_threshold:
+                self.opened_at = time.time()
+            self._trial = False
@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+
+import bisect
+import threading
+
+from future.builtins import object
+
+# Path segments that are part of the API structure, everything else is an identifier (pool name, object code)
+ENDPOINT_SEGMENTS = frozenset(("api", "pool", "invoice", "status", "openbudget", "checkout", "v2", "order"))
+# Upper bounds (in seconds) of the request latency histogram buckets, the last bucket catches everything else
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def endpoint_template(url):
+    """Maps url to the endpoint it belongs to, for example 'pool/{id}/invoice/{id}/status/'"""
+    path = url.split('?', 1)[0].split('://', 1)[-1]
+    segments = path.split('/')[1:]  # Drop the host
+    if segments and segments[0] == 'api':
+        segments = segments[1:]
+    return '/'.join(s if (not s or s in ENDPOINT_SEGMENTS) else '{id}' for s in segments)
+
+
+class EndpointStats(object):
+    """Counters for one endpoint template"""
+
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.retries = 0
+        self.bytes = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.seconds = 0.0
+        self.latency = [0] * (len(LATENCY_BUCKETS) + 1)
+
+    def as_dict(self):
+        return {
+            'requests': self.requests,
+            'errors': self.errors,
+            'retries': self.retries,
+            'bytes': self.bytes,
+            'cache_hits': self.cache_hits,
+            'cache_misses': self.cache_misses,
+            'seconds': self.seconds,
+            'latency_buckets': dict(zip(LATENCY_BUCKETS + (float('inf'),), self.latency)),
+        }
+
+
+class Metrics(object):
+    """Collects per-endpoint request statistics for a Connection
+
+    Read them with snapshot() (or Connection.stats()), or register callbacks with add_callback() to push them to
+    your metrics system. Callbacks are called as callback(event, data) where event is one of 'request', 'retry',
+    'cache' and 'lazy_fetch' and data is a dict, they must be fast and must not raise."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._endpoints = {}
+        self._lazy_fetches = {}
+        self._callbacks = []
+
+    def add_callback(self, callback):
+        self._callbacks.append(callback)
+
+    def remove_callback(self, callback):
+        self._callbacks.remove(callback)
+
+    def _emit(self, event, data):
+        for callback in self._callbacks:
+            callback(event, data)
+
+    def _endpoint(self, endpoint):
+        """Must be called holding the lock"""
+        stats = self._endpoints.get(endpoint)
+        if stats is None:
+            stats = self._endpoints[endpoint] = EndpointStats()
+        return stats
+
+    def record_request(self, method, url, status, seconds, nbytes):
+        """status is None if the request failed without a response"""
+        endpoint = endpoint_template(url)
+        with self._lock:
+            stats = self._endpoint(endpoint)
+            stats.requests += 1
+            if status is None or status >= 400:
+                stats.errors += 1
+            stats.bytes += nbytes
+            stats.seconds += seconds
+            stats.latency[bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+        if self._callbacks:
+            self._emit('request', {'endpoint': endpoint, 'method': method, 'status': status, 'seconds': seconds,
+                                   'bytes': nbytes})
+
+    def record_retry(self, method, url):
+        endpoint = endpoint_template(url)
+        with self._lock:
+            self._endpoint(endpoint).retries += 1
+        if self._callbacks:
+            self._emit('retry', {'endpoint': endpoint, 'method': method})
+
+    def record_cache(self, url, hit):
+        endpoint = endpoint_template(url)
+        with self._lock:
+            stats = self._endpoint(endpoint)
+            if hit:
+                stats.cache_hits += 1
+            else:
+                stats.cache_misses += 1
+        if self._callbacks:
+            self._emit('cache', {'endpoint': endpoint, 'hit': hit})
+
+    def record_lazy_fetch(self, klass):
+        with self._lock:
+            self._lazy_fetches[klass] = self._lazy_fetches.get(klass, 0) + 1
+        if self._callbacks:
+            self._emit('lazy_fetch', {'class': klass})
+
+    def snapshot(self):
+        """Returns the current statistics as a dict (safe to modify)"""
+        with self._lock:
+            return {
+                'endpoints': {k: v.as_dict() for (k, v) in self._endpoints.items()},
+                'lazy_fetches': dict(self._lazy_fetches),
+            }
+
+    def reset(self):
+        with self._lock:
+            self._endpoints.clear()
+            self._lazy_fetches.clear()
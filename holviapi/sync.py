@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+
+import datetime
+import json
+import os
+import tempfile
+import threading
+
+import dateutil.tz
+from future.builtins import object
+
+from .checkout import CheckoutAPI
+from .invoicing import InvoiceAPI
+from .utils import parse_datetime
+
+
+def format_time(value):
+    """Formats datetime for the time filters of Holvi, naive ones are taken as UTC"""
+    if value.tzinfo is not None:
+        value = value.astimezone(dateutil.tz.tzutc()).replace(tzinfo=None)
+    return value.strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+
+
+class MemoryMarkStore(object):
+    """Keeps the high-water marks of DeltaSync in memory, lost when the process exits"""
+
+    def __init__(self):
+        self._marks = {}
+
+    def get(self, key):
+        """The state stored for key or None"""
+        return self._marks.get(key)
+
+    def set(self, key, state):
+        """Stores state (JSON serializable dict) for key"""
+        self._marks[key] = state
+
+
+class FileMarkStore(MemoryMarkStore):
+    """Keeps the high-water marks of DeltaSync in a JSON file, the file is replaced atomically on each set"""
+
+    def __init__(self, path):
+        super(FileMarkStore, self).__init__()
+        self.path = path
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            with open(path) as f:
+                self._marks = json.load(f)
+
+    def set(self, key, state):
+        with self._lock:
+            self._marks[key] = state
+            fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(self.path)))
+            with os.fdopen(fd, 'w') as f:
+                json.dump(self._marks, f)
+            getattr(os, 'replace', os.rename)(tmp, self.path)
+
+
+class DeltaSync(object):
+    """Fetches only the invoices and orders changed since the previous sync, using their update times
+
+    The high-water mark (latest update time seen) is kept per pool and resource in marks (MemoryMarkStore by
+    default, use FileMarkStore or holviapi.mirror.Mirror to keep them between runs). Each sync asks for records
+    updated since the mark minus overlap seconds to allow for clock skew between Holvis servers, records already
+    passed to upsert with the same update time are skipped so each change is upserted once.
+    The mark is advanced only when the whole listing has been read, after an error the next sync starts over."""
+
+    def __init__(self, connection, marks=None, overlap=300):
+        self.connection = connection
+        if marks is None:
+            marks = MemoryMarkStore()
+        self.marks = marks
+        self.overlap = overlap
+        self.invoices_api = InvoiceAPI(connection)
+        self.checkout_api = CheckoutAPI(connection)
+
+    def sync_invoices(self, upsert, full=False):
+        """Calls upsert(invoice) for each invoice changed since the previous sync (all of them if full is True)
+
+        Returns dict with the number of invoices fetched and upserted and the new mark."""
+        return self._sync('invoices', 'update_time_from', self.invoices_api.list_invoices, upsert, full)
+
+    def sync_orders(self, upsert, full=False):
+        """Calls upsert(order) for each order changed since the previous sync (all of them if full is True), see
+        sync_invoices"""
+        return self._sync('orders', 'filter_update_time_from', self.checkout_api.list_orders, upsert, full)
+
+    def _sync(self, resource, param, list_method, upsert, full):
+        key = "%s:%s" % (self.connection.pool, resource)
+        overlap = datetime.timedelta(seconds=self.overlap)
+        state = None if full else self.marks.get(key)
+        mark = None
+        # Update times of the records upserted in the overlap window by the previous sync and this one by code
+        upserted_times = {}
+        params = {'stream': True}
+        if state:
+            mark = parse_datetime(state['mark'])
+            upserted_times = dict(state['recent'])
+            params[param] = format_time(mark - overlap)
+        fetched = upserted = 0
+        for obj in list_method(**params):
+            fetched += 1
+            updated = obj._jsondata.get('update_time') or obj._jsondata.get('create_time')
+            previous = upserted_times.get(obj.code, False)
+            if previous is not False and (updated is None or (previous is not None and
+                                                              parse_datetime(previous) >= parse_datetime(updated))):
+                continue
+            upsert(obj)
+            upserted += 1
+            upserted_times[obj.code] = updated
+            updated = parse_datetime(updated)
+            if updated is not None and (mark is None or updated > mark):
+                mark = updated
+        if mark is not None:
+            recent = {code: updated for (code, updated) in upserted_times.items()
+                      if updated is not None and parse_datetime(updated) >= mark - overlap}
+            self.marks.set(key, {'mark': mark.isoformat(), 'recent': recent})
+        return {'fetched': fetched, 'upserted': upserted, 'mark': mark}
@@ -1,7 +1,10 @@
+import io
+import json
 import os
 
 import holviapi
 import pytest
+import requests
 
 
 @pytest.fixture
@@ -30,3 +33,40 @@ def categoriesapi(connection):
 def productsapi(connection):
     pa = holviapi.ProductsAPI(connection)
     return pa
+
+
+class FakeSession(object):
+    """Stands in for requests.Session, serves canned JSON bodies by url and records the calls
+
+    statuses maps urls to lists of status codes to answer with before falling back to 200, the params of
+    each call are in params"""
+
+    def __init__(self, bodies, statuses=None):
+        self.bodies = bodies
+        self.statuses = statuses or {}
+        self.calls = []
+        self.params = []
+        self.headers = {}
+
+    def _respond(self, method, url, **kwargs):
+        self.calls.append((method, url))
+        self.params.append(kwargs.get('params'))
+        r = requests.Response()
+        r.status_code = 200
+        if self.statuses.get(url):
+            r.status_code = self.statuses[url].pop(0)
+        r.url = url
+        r.raw = io.BytesIO(json.dumps(self.bodies.get(url, {})).encode('utf-8'))
+        return r
+
+    def get(self, url, **kwargs):
+        return self._respond('get', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self._respond('post', url, **kwargs)
+
+    def put(self, url, **kwargs):
+        return self._respond('put', url, **kwargs)
+
+    def patch(self, url, **kwargs):
+        return self._respond('patch', url, **kwargs)
@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+import asyncio
+
+import holviapi
+import pytest
+
+aiohttp = pytest.importorskip('aiohttp')
+from aiohttp import web  # isort:skip
+from aiohttp.test_utils import TestServer  # isort:skip
+from holviapi.aio import AsyncConnection, AsyncInvoiceAPI, AsyncCheckoutAPI, fetch  # isort:skip
+from holviapi.cache import NullCache  # isort:skip
+from holviapi.retry import CircuitBreaker  # isort:skip
+
+
+def _order(code):
+    return {"code": code, "purchases": [{"product": "prod1", "detailed_price": {"net": "10.00", "gross": "12.40"}}]}
+
+
+async def _handle_orders(request):
+    if request.query.get('page') == '2':
+        return web.json_response({"count": 3, "next": None, "results": [_order("o3")]})
+    nxt = str(request.url.with_query({'page': '2'}))
+    return web.json_response({"count": 3, "next": nxt, "results": [_order("o1"), _order("o2")]})
+
+
+INVOICE_HITS = []
+
+
+async def _handle_invoice(request):
+    INVOICE_HITS.append(request.match_info['code'])
+    if request.match_info['code'] == 'slow':
+        await asyncio.sleep(0.2)
+    if request.match_info['code'] == 'missing':
+        return web.json_response({"detail": "Not found"}, status=404)
+    return web.json_response({"code": request.match_info['code'], "subject": "test", "issue_date": "2016-01-20",
+                              "due_date": "2016-02-03", "receiver": {"name": "Example"},
+                              "items": [{"category": "cat1", "detailed_price": {"net": "1.00", "gross": "1.24"}}]})
+
+
+async def _handle_openbudget(request):
+    return web.json_response({"income_categories": [{"code": "cat1", "name": "Income"}], "expense_categories": [],
+                              "products": [{"code": "prod1", "name": "Product", "questions": []}]})
+
+
+async def _handle_head(request):
+    await asyncio.sleep(1)
+    return web.Response()
+
+
+def _run(coro_fn):
+    async def runner():
+        app = web.Application()
+        app.router.add_get('/api/checkout/v2/pool/testpool/order/', _handle_orders)
+        app.router.add_get('/api/pool/testpool/invoice/{code}/', _handle_invoice)
+        app.router.add_get('/api/pool/testpool/openbudget/', _handle_openbudget)
+        app.router.add_route('HEAD', '/api/', _handle_head)
+        server = TestServer(app)
+        await server.start_server()
+        cnc = AsyncConnection('testpool', 'testkey', cache=NullCache())
+        cnc.base_url_fmt = str(server.make_url('/api/'))
+        try:
+            async with cnc:
+                return await coro_fn(cnc)
+        finally:
+            await server.close()
+    return asyncio.run(runner())
+
+
+def test_async_for_paginates():
+    async def scenario(cnc):
+        orders = await AsyncCheckoutAPI(cnc).list_orders()
+        return [order.code async for order in orders]
+    assert _run(scenario) == ["o1", "o2", "o3"]
+
+
+def test_async_to_columns_paginates():
+    async def scenario(cnc):
+        orders = await AsyncCheckoutAPI(cnc).list_orders()
+        with pytest.raises(TypeError):
+            orders.read_ahead()
+        with pytest.raises(TypeError):
+            next(orders._iter_jsondata())
+        return await orders.to_columns()
+    columns = _run(scenario)
+    assert list(columns['code']) == ["o1", "o2", "o3"]
+    assert list(columns['net']) == [1000] * 3
+
+
+def test_async_stream_rejected():
+    async def scenario(cnc):
+        with pytest.raises(TypeError):
+            await AsyncCheckoutAPI(cnc).list_orders(stream=True)
+        with pytest.raises(TypeError):
+            await AsyncInvoiceAPI(cnc).list_invoices(stream=True)
+    _run(scenario)
+
+
+def test_async_lazy_fetch():
+    async def scenario(cnc):
+        invoice = await AsyncInvoiceAPI(cnc).get_invoice("inv1")
+        category = invoice.items[0].category
+        with pytest.raises(holviapi.HolviError):
+            category.name
+        before = cnc.stats()['lazy_fetches']['IncomeCategory']
+        await fetch(category)
+        await fetch(category)  # Not lazy anymore
+        assert cnc.stats()['lazy_fetches']['IncomeCategory'] == before + 1
+        return category.name
+    assert _run(scenario) == "Income"
+
+
+def test_async_fetch_unknown_reference():
+    async def scenario(cnc):
+        api = holviapi.aio.AsyncCategoriesAPI(cnc)
+        category = holviapi.IncomeCategory(api, {"code": "nosuch"})
+        assert await fetch(category) is category
+        assert category._lazy
+        product = await holviapi.aio.AsyncProductsAPI(cnc).get_product("prod1")
+        question = holviapi.products.ProductQuestion(product, {"code": "nosuch"})
+        assert await fetch(question) is question
+        assert question._lazy
+        # Synchronous fetch methods are not awaited, not finding the object is an error
+        invoice = holviapi.Invoice(AsyncInvoiceAPI(cnc), {"code": "nosuch"})
+        invoice._fetch_method = lambda code: None
+        with pytest.raises(holviapi.HolviError):
+            await fetch(invoice)
+    _run(scenario)
+
+
+def test_async_errors():
+    async def scenario(cnc):
+        with pytest.raises(holviapi.ApiError):
+            await AsyncInvoiceAPI(cnc).get_invoice("missing")
+    _run(scenario)
+
+
+def test_async_gets_coalesced():
+    async def scenario(cnc):
+        api = AsyncInvoiceAPI(cnc)
+        return await asyncio.gather(*[api.get_invoice("inv2") for x in range(5)])
+    invoices = _run(scenario)
+    assert [i.code for i in invoices] == ["inv2"] * 5
+    assert INVOICE_HITS.count("inv2") == 1
+
+
+def test_async_coalesced_owner_cancelled():
+    """Waiters make the request themselves when the task making it is cancelled"""
+    async def scenario(cnc):
+        api = AsyncInvoiceAPI(cnc)
+        owner = asyncio.ensure_future(api.get_invoice("slow"))
+        await asyncio.sleep(0.05)
+        waiters = asyncio.gather(*[api.get_invoice("slow") for x in range(3)])
+        await asyncio.sleep(0.05)
+        owner.cancel()
+        return await waiters
+    invoices = _run(scenario)
+    assert [i.code for i in invoices] == ["slow"] * 3
+    assert INVOICE_HITS.count("slow") == 2
+
+
+def test_async_cancelled_does_not_open_circuit():
+    async def scenario(cnc):
+        cnc.circuit_breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0)
+        request = asyncio.ensure_future(AsyncInvoiceAPI(cnc).get_invoice("slow"))
+        await asyncio.sleep(0.05)
+        request.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await request
+        return cnc.circuit_breaker.is_open
+    assert _run(scenario) is False
+
+
+def test_async_warmup_bounded_by_timeout():
+    async def scenario(cnc):
+        cnc.timeout = (0.1, 0.1)
+        started = asyncio.get_running_loop().time()
+        await cnc.warmup(2)
+        return asyncio.get_running_loop().time() - started
+    assert _run(scenario) < 0.5
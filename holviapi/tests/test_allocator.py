@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+import multiprocessing
+import threading
+
+import holviapi
+import pytest
+from holviapi.utils import (
+    FileBlockStore,
+    MemoryBlockStore,
+    ReferenceAllocator,
+    SQLiteBlockStore,
+    fin_reference_isvalid,
+    int2fin_reference,
+    iso_reference_isvalid,
+    str2iso_reference
+)
+
+from .fixtures import FakeSession
+
+INVOICES_URL = 'https://holvi.com/api/pool/testpool/invoice/'
+
+
+def _allocate(store, count, queue):
+    queue.put(ReferenceAllocator(store, block_size=50).allocate_many(count))
+
+
+@pytest.fixture(params=['memory', 'file', 'sqlite'])
+def store(request, tmpdir):
+    if request.param == 'memory':
+        return MemoryBlockStore()
+    if request.param == 'file':
+        return FileBlockStore(str(tmpdir.join('blocks.json')))
+    return SQLiteBlockStore(str(tmpdir.join('blocks.sqlite')))
+
+
+def test_allocate(store):
+    fin = ReferenceAllocator(store, block_size=10)
+    references = fin.allocate_many(25)
+    assert references[0] == int2fin_reference(1000)
+    assert len(set(references)) == 25
+    assert all(fin_reference_isvalid(r) for r in references)
+    # A second allocator continues after the blocks reserved by the first one
+    assert ReferenceAllocator(store, block_size=10).allocate() == int2fin_reference(1030)
+    iso = ReferenceAllocator(store, key='iso', kind='iso', start=1)
+    assert iso.allocate() == str2iso_reference('1')
+    assert all(iso_reference_isvalid(r) for r in iso.allocate_many(10))
+    with pytest.raises(ValueError):
+        ReferenceAllocator(store, kind='other')
+
+
+def test_limits(store):
+    with pytest.raises(ValueError):
+        ReferenceAllocator(store, start=99)
+    with pytest.raises(ValueError):
+        ReferenceAllocator(store, block_size=0)
+    assert ReferenceAllocator(store, key='short', start=100).allocate() == '1009'
+    fin = ReferenceAllocator(store, key='long', start=10 ** 19 - 1)
+    assert len(fin.allocate()) == 20
+    with pytest.raises(ValueError):
+        fin.allocate()
+    iso = ReferenceAllocator(store, key='iso', kind='iso', start=10 ** 21 - 1)
+    assert len(iso.allocate()) == 25
+    with pytest.raises(ValueError):
+        iso.allocate()
+
+
+def test_allocate_threads(store):
+    allocator = ReferenceAllocator(store, block_size=7)
+    results = []
+
+    def worker():
+        results.extend(allocator.allocate_many(500))
+
+    threads = [threading.Thread(target=worker) for x in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(results) == len(set(results)) == 4000
+
+
+@pytest.mark.parametrize('start_method', [m for m in ('fork', 'spawn') if m in multiprocessing.get_all_start_methods()])
+@pytest.mark.parametrize('kind', ['file', 'sqlite'])
+def test_allocate_processes(kind, start_method, tmpdir):
+    if kind == 'file':
+        store = FileBlockStore(str(tmpdir.join('blocks.json')))
+    else:
+        store = SQLiteBlockStore(str(tmpdir.join('blocks.sqlite')))
+    # Used in the parent before the children are started
+    results = ReferenceAllocator(store, block_size=50).allocate_many(10)
+    context = multiprocessing.get_context(start_method)
+    queue = context.Queue()
+    processes = [context.Process(target=_allocate, args=(store, 300, queue)) for x in range(4)]
+    for p in processes:
+        p.start()
+    for p in processes:
+        results.extend(queue.get(timeout=60))
+    for p in processes:
+        p.join()
+    results.extend(ReferenceAllocator(store, block_size=50).allocate_many(10))
+    assert len(results) == len(set(results)) == 1220
+
+
+def test_seed_from_invoices():
+    cnc = holviapi.Connection('testpool', 'testkey')
+    cnc.session = FakeSession({INVOICES_URL: [
+        {"code": "i1", "reference": int2fin_reference(5000)},
+        {"code": "i2", "reference": int2fin_reference(123456)},
+        {"code": "i3", "reference": "123457"},  # Invalid checksum
+        {"code": "i4", "reference": str2iso_reference('999999')},
+        {"code": "i5", "reference": None},
+        {"code": "i6", "reference": u"\u00b2"},  # Non-ASCII digits are not our references
+        {"code": "i7", "reference": u"RF18 \u00b2"},
+    ]})
+    allocator = ReferenceAllocator(MemoryBlockStore())
+    assert allocator.allocate() == int2fin_reference(1000)
+    assert allocator.seed_from_invoices(holviapi.InvoiceAPI(cnc), reference='') == 123456
+    assert cnc.session.params[0] == {'reference': ''}
+    assert allocator.allocate() == int2fin_reference(123457)
+    iso = ReferenceAllocator(MemoryBlockStore(), kind='iso')
+    assert iso.seed_from_invoices(holviapi.InvoiceAPI(cnc)) == 999999
+
+
+def test_seed_drops_reserved_block(store):
+    allocator = ReferenceAllocator(store, block_size=100)
+    allocator.allocate()
+    allocator.seed(5000)
+    assert allocator.allocate() == int2fin_reference(5000)
+    # Seeding never moves the numbers backwards, the rest of the dropped block is skipped
+    allocator.seed(10)
+    assert allocator.allocate() == int2fin_reference(5100)
@@ -1,10 +1,11 @@
 # -*- coding: utf-8 -*-
+import io
 import random
 from datetime import date
 from decimal import Decimal
 
 import pytest
-from holviapi.utils import BarcodeException, barcode
+from holviapi.utils import BarcodeException, barcode, barcodes, barcodes_from_csv
 
 
 def test_barcode_v5():
@@ -49,3 +50,71 @@ def test_barcode_invalid_amount():
         assert False, "Barcode payment amount must be less than 1000000.00, invalid amount was not detected"
     except BarcodeException as e:
         pass
+
+
+SPEC_ROWS = [
+    ("RF09 8685 1625 9619 897", Decimal("4883.15"), date(2010, 6, 12)),
+    ("RF02 6987 5672 0834", Decimal("693.80"), date(2011, 7, 24)),
+    ("RF60 7877 7679 6566 2868 7", Decimal("935.85"), None),
+    ("RF10 8686 24", Decimal("0.00"), date(2013, 8, 9)),
+    ("86851 62596 19897", Decimal("4883.15"), date(2010, 6, 12)),
+    ("13 57914", Decimal("0.02"), date(2099, 12, 24)),
+    ("92125 37425 25398 97737", Decimal("150000.20"), date(2016, 5, 25)),
+]
+
+
+def test_barcodes_matches_barcode():
+    iban = "FI79 4405 2020 0360 82"
+    expected = [barcode(iban, *row) for row in SPEC_ROWS]
+    assert list(barcodes(iban, SPEC_ROWS)) == expected
+    as_strings = [(r, str(a), d.isoformat() if d else None) for (r, a, d) in SPEC_ROWS]
+    assert list(barcodes(iban, as_strings)) == expected
+    assert list(barcodes(iban, [("13 57914", 1)])) == [barcode(iban, "13 57914", Decimal("1.00"))]
+
+
+def test_barcodes_row_errors():
+    results = list(barcodes("FI79 4405 2020 0360 82", [
+        ("RF09 8685 1625 9619 897", "1000000.00"),
+        ("86851 62596 19897", "4883.15", date(2010, 6, 12)),
+        ("8685X", "1.00"),
+        ("86851 62596 19897", "abc"),
+        ("86851 62596 19897", "-1.00"),
+        ("86851 62596 19897", "1.00", "not a date"),
+        ("86851 62596 19897",),
+    ]))
+    assert results[1] == "479440520200360820048831500000000868516259619897100612"
+    for i in (0, 2, 3, 4, 5, 6):
+        assert isinstance(results[i], BarcodeException)
+
+
+def test_barcodes_non_string_and_non_ascii():
+    iban = "FI79 4405 2020 0360 82"
+    results = list(barcodes(iban, [
+        ("13 57914", "1.00"),
+        (1357914, "1.00"),
+        (u"13 5791\u2074", "1.00"),
+        ("13 57914", u"1.0\u00b2"),
+        (None, "1.00"),
+    ]))
+    assert results[1] == results[0] == barcode(iban, "13 57914", Decimal("1.00"))
+    for i in (2, 3, 4):
+        assert isinstance(results[i], BarcodeException)
+
+
+def test_barcodes_invalid_iban():
+    with pytest.raises(BarcodeException):
+        barcodes(u"FI79 4405 2020 0360 8\u00b2", [])
+    with pytest.raises(BarcodeException):
+        barcodes("DE79 4405 2020 0360 82", [])
+    with pytest.raises(BarcodeException):
+        barcodes("FI79 4405 2020 0360 83", [])
+
+
+def test_barcodes_from_csv():
+    csvfile = io.StringIO(u"reference,amount,due\n"
+                          u"RF09 8685 1625 9619 897,4883.15,2010-06-12\n"
+                          u"RF60 7877 7679 6566 2868 7,935.85,\n")
+    assert list(barcodes_from_csv("FI79 4405 2020 0360 82", csvfile, header=True)) == [
+        "579440520200360820048831509000000868516259619897100612",
+        "579440520200360820009358560000078777679656628687000000",
+    ]
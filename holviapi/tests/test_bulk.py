@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+import json
+import threading
+import time
+
+import holviapi
+import pytest
+import requests
+from holviapi.bulk import RateLimiter, map_concurrently
+
+from .fixtures import FakeSession
+
+INVOICES_URL = 'https://holvi.com/api/pool/testpool/invoice/'
+
+
+class InvoiceSession(FakeSession):
+    """Echoes posted invoices back with a code, subject 'fail' gets 400, tracks the number of concurrent posts"""
+
+    def __init__(self):
+        super(InvoiceSession, self).__init__({INVOICES_URL: []})
+        self.lock = threading.Lock()
+        self.active = 0
+        self.max_active = 0
+
+    def post(self, url, **kwargs):
+        payload = kwargs['json']
+        with self.lock:
+            self.calls.append(('post', url))
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        time.sleep(0.02)
+        with self.lock:
+            self.active -= 1
+        r = requests.Response()
+        r.url = url
+        r.status_code = 400 if payload["subject"] == "fail" else 201
+        r._content = json.dumps(dict(payload, code="code-" + payload["subject"])).encode('utf-8')
+        return r
+
+
+def _invoice(api, subject, items=True):
+    invoice = holviapi.Invoice(api)
+    invoice.subject = subject
+    if items:
+        invoice.items.append(holviapi.InvoiceItem(invoice))
+    return invoice
+
+
+@pytest.fixture
+def invoicesapi():
+    cnc = holviapi.Connection('testpool', 'testkey')
+    cnc.session = InvoiceSession()
+    return holviapi.InvoiceAPI(cnc)
+
+
+def test_map_concurrently_order():
+    assert map_concurrently(lambda x: x * 2, range(20), concurrency=5) == [x * 2 for x in range(20)]
+    assert map_concurrently(lambda x: x, [], concurrency=5) == []
+
+
+def test_map_concurrently_errors():
+    def func(x):
+        if x == 3:
+            raise holviapi.HolviError("three")
+        return x
+    results = map_concurrently(func, range(5))
+    assert isinstance(results[3], holviapi.HolviError)
+    assert results[4] == 4
+
+    def broken(x):
+        raise KeyError(x)
+    with pytest.raises(KeyError):
+        map_concurrently(broken, range(5))
+
+
+def test_create_many(invoicesapi):
+    invoicesapi.connection.make_get(INVOICES_URL)
+    invoices = [_invoice(invoicesapi, "inv%d" % n) for n in range(8)]
+    invoices.insert(2, _invoice(invoicesapi, "fail"))
+    invoices.insert(5, _invoice(invoicesapi, "noitems", items=False))
+    results = invoicesapi.create_many(invoices, concurrency=4)
+    session = invoicesapi.connection.session
+    assert session.max_active > 1
+    assert len([c for c in session.calls if c[0] == 'post']) == 9
+    assert [r.code for r in results if isinstance(r, holviapi.Invoice)] == ["code-inv%d" % n for n in range(8)]
+    assert isinstance(results[2], holviapi.ApiError)
+    assert isinstance(results[5], holviapi.HolviError)
+    # Created invoices are cached, the list is not
+    del session.calls[:]
+    assert invoicesapi.get_invoice("code-inv0").subject == "inv0"
+    invoicesapi.connection.make_get(INVOICES_URL)
+    assert session.calls == [('get', INVOICES_URL)]
+
+
+def test_rate_limiter():
+    limiter = RateLimiter(100, burst=3)
+    assert [limiter.reserve() for x in range(3)] == [0, 0, 0]
+    assert limiter.reserve() > 0
+    limiter = RateLimiter(50)
+    started = time.time()
+    map_concurrently(lambda x: x, range(6), concurrency=3, rate=limiter)
+    assert time.time() - started >= 0.09
+
+
+def test_send_and_void_many(invoicesapi):
+    session = invoicesapi.connection.session
+    session.bodies[INVOICES_URL + 'inv1/status/'] = {"active": True}
+    session.statuses[INVOICES_URL + 'inv2/status/'] = [400]
+    invoice = holviapi.Invoice(invoicesapi, {"code": "inv3", "items": []})
+    results = invoicesapi.send_many(["inv1", "inv2", invoice, "inv1"], send_email=False, concurrency=2, rate=1000)
+    assert sorted(results) == ["inv1", "inv2", "inv3"]
+    assert results["inv1"] == {"active": True}
+    assert isinstance(results["inv2"], holviapi.ApiError)
+    assert len(session.calls) == 3
+    results = invoicesapi.void_many(["inv1", "inv2"])
+    assert results["inv2"] == {}
@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+import multiprocessing
+import sqlite3
+import time
+
+import pytest
+from holviapi.cache import MemoryCache, NullCache, SQLiteCache, cache_key
+
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def cache(request, tmpdir):
+    if request.param == 'sqlite':
+        return SQLiteCache(str(tmpdir.join('cache.sqlite')), expire_after=300)
+    return MemoryCache(expire_after=300)
+
+
+def test_cache_key_param_order():
+    assert cache_key('https://example.com/') == 'https://example.com/'
+    assert cache_key('https://example.com/', {'b': 2, 'a': 1}) == cache_key('https://example.com/', {'a': 1, 'b': 2})
+
+
+def test_set_get_delete(cache):
+    assert cache.get('foo') is None
+    cache.set('foo', '{"code": "foo"}')
+    assert cache.get('foo') == '{"code": "foo"}'
+    cache.delete('foo')
+    assert cache.get('foo') is None
+    cache.delete('foo')
+
+
+def test_delete_prefix(cache):
+    cache.set('https://example.com/a/', '1')
+    cache.set('https://example.com/a/b/', '2')
+    cache.set('https://example.com/c/', '3')
+    cache.delete_prefix('https://example.com/a/')
+    assert cache.get('https://example.com/a/') is None
+    assert cache.get('https://example.com/a/b/') is None
+    assert cache.get('https://example.com/c/') == '3'
+    cache.clear()
+    assert cache.get('https://example.com/c/') is None
+
+
+def test_expiry(cache):
+    cache.expire_after = 0.01
+    cache.set('foo', 'bar')
+    time.sleep(0.02)
+    assert cache.get('foo') is None
+
+
+def test_version(cache):
+    assert cache.version('foo') is None
+    cache.set('foo', 'bar')
+    version = cache.version('foo')
+    assert version is not None
+    assert cache.version('foo') == version
+    # Setting the same body again is a new version too
+    cache.set('foo', 'bar')
+    assert cache.version('foo') != version
+    cache.delete('foo')
+    assert cache.version('foo') is None
+    cache.expire_after = 0.01
+    cache.set('foo', 'bar')
+    time.sleep(0.02)
+    assert cache.version('foo') is None
+
+
+def test_sqlite_adds_version_column(tmpdir):
+    path = str(tmpdir.join('cache.sqlite'))
+    db = sqlite3.connect(path)
+    db.execute("CREATE TABLE responses (key TEXT PRIMARY KEY, value TEXT, expires REAL)")
+    db.execute("INSERT INTO responses VALUES ('foo', 'old', NULL)")
+    db.commit()
+    db.close()
+    cache = SQLiteCache(path)
+    assert cache.get('foo') == 'old'
+    version = cache.version('foo')
+    assert version is not None
+    cache.set('foo', 'new')
+    assert cache.version('foo') != version
+
+
+def test_sqlite_survives_reopen(tmpdir):
+    path = str(tmpdir.join('cache.sqlite'))
+    SQLiteCache(path).set('foo', 'bar')
+    assert SQLiteCache(path).get('foo') == 'bar'
+
+
+def test_sqlite_purges_expired_on_set(tmpdir):
+    path = str(tmpdir.join('cache.sqlite'))
+    cache = SQLiteCache(path, expire_after=0.01)
+    cache.purge_every = 5
+    for n in range(4):
+        cache.set('key%d' % n, 'value')
+    time.sleep(0.02)
+    cache.expire_after = 300
+    cache.set('fresh', 'value')
+    assert sqlite3.connect(path).execute("SELECT key FROM responses").fetchall() == [('fresh',)]
+
+
+def _use_cache(cache, queue):
+    cache.set('child', 'set by child')
+    queue.put(cache.get('parent'))
+
+
+@pytest.mark.parametrize('start_method', [m for m in ('fork', 'spawn') if m in multiprocessing.get_all_start_methods()])
+def test_sqlite_shared_by_processes(tmpdir, start_method):
+    cache = SQLiteCache(str(tmpdir.join('cache.sqlite')))
+    # The connection is open in the parent when the child is started
+    cache.set('parent', 'set by parent')
+    context = multiprocessing.get_context(start_method)
+    queue = context.Queue()
+    p = context.Process(target=_use_cache, args=(cache, queue))
+    p.start()
+    assert queue.get(timeout=60) == 'set by parent'
+    p.join()
+    assert cache.get('child') == 'set by child'
+
+
+def test_null_cache():
+    cache = NullCache()
+    cache.set('foo', 'bar')
+    assert cache.get('foo') is None
+
+
+def test_memory_lru_max_entries():
+    cache = MemoryCache(max_entries=2)
+    cache.set('a', '1')
+    cache.set('b', '2')
+    cache.get('a')
+    cache.set('c', '3')
+    assert cache.get('b') is None
+    assert cache.get('a') == '1'
+    assert cache.get('c') == '3'
+    assert len(cache) == 2
+
+
+def test_memory_lru_max_bytes():
+    cache = MemoryCache(max_bytes=10)
+    cache.set('a', '1234')
+    cache.set('b', '1234')
+    assert cache.size == 10
+    cache.set('c', '1')
+    assert cache.get('a') is None
+    assert cache.size == 7
+
+
+def test_memory_expiry_amortized():
+    cache = MemoryCache(expire_after=0.01)
+    for x in range(10):
+        cache.set(str(x), 'x')
+    time.sleep(0.02)
+    cache.set('fresh', 'x')
+    assert len(cache) == 9
+    cache.purge_expired()
+    assert len(cache) == 1
+    assert cache.get('fresh') == 'x'
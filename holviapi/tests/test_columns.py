@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+import calendar
+import datetime
+from decimal import Decimal
+
+import holviapi
+import pytest
+from holviapi.columns import MISSING, to_cents, to_epoch
+
+from .fixtures import FakeSession
+
+INVOICES_URL = 'https://holvi.com/api/pool/testpool/invoice/'
+ORDERS_URL = 'https://holvi.com/api/checkout/v2/pool/testpool/order/'
+
+
+@pytest.mark.parametrize('value,cents', [
+    ("12.40", 1240), ("12.4", 1240), ("12", 1200), ("-0.50", -50), ("0.005", 1), ("1.234", 123), (None, 0),
+    (Decimal("3.10"), 310), (2, 200),
+])
+def test_to_cents(value, cents):
+    assert to_cents(value) == cents
+
+
+def test_to_epoch():
+    assert to_epoch("2016-01-20T10:11:12.5Z") == calendar.timegm(datetime.datetime(2016, 1, 20, 10, 11, 12).timetuple())
+    assert to_epoch("2016-01-20T12:11:12+02:00") == to_epoch("2016-01-20T10:11:12Z")
+    assert to_epoch(None) == MISSING
+
+
+def test_invoice_columns():
+    cnc = holviapi.Connection('testpool', 'testkey')
+    cnc.session = FakeSession({INVOICES_URL: [
+        {"code": "inv1", "status": "paid", "create_time": "2016-01-20T10:11:12Z", "paid_time": "2016-01-21T10:11:12Z",
+         "items": [{"category": "cat1", "detailed_price": {"net": "10.00", "gross": "12.40"}},
+                   {"category": "cat2", "detailed_price": {"net": "0.99", "gross": "1.23"}}]},
+        {"code": "inv2", "status": "issued", "create_time": "2016-01-22T10:11:12Z", "paid_time": None,
+         "items": [{"category": None, "detailed_price": {"net": "5", "gross": "5"}}]},
+    ]})
+    for stream in (False, True):
+        columns = holviapi.InvoiceAPI(cnc).list_invoices(stream=stream).to_columns()
+        assert columns['code'] == ["inv1", "inv1", "inv2"]
+        assert columns['status'] == ["paid", "paid", "issued"]
+        assert columns['category'] == ["cat1", "cat2", None]
+        assert list(columns['net']) == [1000, 99, 500]
+        assert sum(columns['gross']) == 1863
+        assert columns['paid_time'][2] == MISSING
+        assert columns['create_time'][0] == to_epoch("2016-01-20T10:11:12Z")
+
+
+def test_order_columns():
+    cnc = holviapi.Connection('testpool', 'testkey')
+    purchase = {"product": "prod1", "detailed_price": {"net": "10.00", "gross": "12.40"}}
+    cnc.session = FakeSession({
+        ORDERS_URL: {"count": 3, "next": ORDERS_URL + "page2/", "results": [
+            {"code": "o1", "create_time": "2016-01-20T10:11:12Z", "purchases": [purchase, purchase]}]},
+        ORDERS_URL + "page2/": {"count": 3, "next": None, "results": [
+            {"code": "o2", "purchases": [dict(purchase, product="prod2")]}]},
+    })
+    checkoutapi = holviapi.CheckoutAPI(cnc)
+    columns = checkoutapi.list_orders().to_columns()
+    assert columns['code'] == ["o1", "o1", "o2"]
+    assert columns['product'] == ["prod1", "prod1", "prod2"]
+    assert sum(columns['net']) == 3000
+    assert list(columns['paid_time']) == [MISSING] * 3
+    assert sum(columns['gross']) == sum(order.gross for order in checkoutapi.list_orders()) * 100
@@ -0,0 +1,391 @@
+# -*- coding: utf-8 -*-
+import threading
+import time
+
+import holviapi
+import pytest
+import requests
+from holviapi.cache import MemoryCache
+from holviapi.retry import CircuitBreaker, RetryPolicy
+from holviapi.stats import endpoint_template
+
+from .fixtures import FakeSession
+
+INVOICES_URL = 'https://holvi.com/api/pool/testpool/invoice/'
+INVOICE_URL = INVOICES_URL + 'abc/'
+
+
+@pytest.fixture
+def connection():
+    cnc = holviapi.Connection('testpool', 'testkey')
+    cnc.session = FakeSession({
+        INVOICES_URL: [{'code': 'abc'}],
+        INVOICE_URL: {'code': 'abc', 'subject': 'old'},
+        INVOICE_URL + 'status/': {'active': False},
+        'https://holvi.com/api/pool/testpool/openbudget/': {'products': []},
+    })
+    return cnc
+
+
+def test_get_is_cached(connection):
+    connection.make_get(INVOICE_URL)
+    connection.make_get(INVOICE_URL)
+    assert connection.session.calls == [('get', INVOICE_URL)]
+
+
+def test_mutation_invalidates_only_affected(connection):
+    connection.make_get(INVOICES_URL)
+    connection.make_get(INVOICES_URL, params={'status': 'paid'})
+    connection.make_get(INVOICE_URL)
+    connection.make_get('https://holvi.com/api/pool/testpool/openbudget/')
+    connection.make_put(INVOICE_URL + 'status/', {'void': True})
+    del connection.session.calls[:]
+    connection.make_get(INVOICES_URL)
+    connection.make_get(INVOICES_URL, params={'status': 'paid'})
+    connection.make_get(INVOICE_URL)
+    connection.make_get('https://holvi.com/api/pool/testpool/openbudget/')
+    assert connection.session.calls == [
+        ('get', INVOICES_URL),
+        ('get', INVOICES_URL),
+        ('get', INVOICE_URL),
+    ]
+
+
+def test_cache_put_write_through(connection):
+    connection.cache_put(INVOICE_URL, {'code': 'abc', 'subject': 'new'})
+    assert connection.make_get(INVOICE_URL)['subject'] == 'new'
+    assert connection.session.calls == []
+
+
+def test_get_derived(connection):
+    derived = []
+
+    def derive(jsondata):
+        derived.append(jsondata)
+        return {item['code']: item for item in jsondata}
+
+    assert connection.make_get_derived(INVOICES_URL, 'by_code', derive)['abc'] == {'code': 'abc'}
+    assert connection.make_get_derived(INVOICES_URL, 'by_code', derive) is connection.make_get_derived(
+        INVOICES_URL, 'by_code', derive)
+    assert len(derived) == 1
+    connection.invalidate(INVOICES_URL)
+    connection.make_get_derived(INVOICES_URL, 'by_code', derive)
+    assert len(derived) == 2
+    assert len(connection.session.calls) == 2
+
+
+class CountingCache(MemoryCache):
+
+    def __init__(self):
+        super(CountingCache, self).__init__()
+        self.gets = 0
+
+    def get(self, key):
+        self.gets += 1
+        return super(CountingCache, self).get(key)
+
+
+def test_get_derived_does_not_read_body(connection):
+    connection.cache = CountingCache()
+    index = connection.make_get_derived(INVOICES_URL, 'by_code', lambda jsondata: {})
+    gets = connection.cache.gets
+    assert connection.make_get_derived(INVOICES_URL, 'by_code', lambda jsondata: {}) is index
+    assert connection.cache.gets == gets
+    connection.cache_put(INVOICES_URL, [])
+    assert connection.make_get_derived(INVOICES_URL, 'by_code', lambda jsondata: {}) is not index
+
+
+def test_get_retried(connection):
+    connection.retry = RetryPolicy(backoff_factor=0)
+    connection.session.statuses[INVOICE_URL] = [502, 503]
+    assert connection.make_get(INVOICE_URL)['code'] == 'abc'
+    assert len(connection.session.calls) == 3
+
+
+def test_retries_exhausted(connection):
+    connection.retry = RetryPolicy(total=1, backoff_factor=0)
+    connection.session.statuses[INVOICE_URL] = [502, 502, 502]
+    with pytest.raises(holviapi.ApiError):
+        connection.make_get(INVOICE_URL)
+    assert len(connection.session.calls) == 2
+
+
+def test_put_not_retried(connection):
+    connection.retry = RetryPolicy(backoff_factor=0)
+    connection.session.statuses[INVOICE_URL] = [502]
+    with pytest.raises(holviapi.ApiError):
+        connection.make_put(INVOICE_URL, {})
+    assert len(connection.session.calls) == 1
+
+
+def test_circuit_breaker(connection):
+    connection.retry = RetryPolicy(total=0)
+    connection.circuit_breaker = CircuitBreaker(failure_threshold=2, reset_timeout=0)
+    connection.session.statuses[INVOICE_URL] = [500, 500]
+    for x in range(2):
+        with pytest.raises(holviapi.ApiError):
+            connection.make_get(INVOICE_URL)
+    assert connection.circuit_breaker.is_open
+    # reset_timeout has passed so a trial request goes through and closes the circuit
+    connection.make_get(INVOICE_URL)
+    assert not connection.circuit_breaker.is_open
+    connection.circuit_breaker.reset_timeout = 60
+    connection.circuit_breaker.record_failure()
+    connection.circuit_breaker.record_failure()
+    with pytest.raises(holviapi.CircuitOpenError):
+        connection.make_get(INVOICES_URL)
+
+
+class BrokenSession(FakeSession):
+
+    def get(self, url, **kwargs):
+        raise requests.exceptions.ChunkedEncodingError("Connection broken")
+
+
+def test_circuit_breaker_trial_not_retried_error(connection):
+    connection.retry = RetryPolicy(total=0)
+    connection.circuit_breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0)
+    connection.circuit_breaker.record_failure()
+    working = connection.session
+    connection.session = BrokenSession({})
+    # The trial request fails reading the response, it must end the trial
+    with pytest.raises(holviapi.ApiError) as excinfo:
+        connection.make_get(INVOICE_URL)
+    assert isinstance(excinfo.value.__cause__, requests.exceptions.ChunkedEncodingError)
+    assert connection.circuit_breaker.is_open
+    connection.session = working
+    connection.make_get(INVOICE_URL)
+    assert not connection.circuit_breaker.is_open
+
+
+def test_circuit_breaker_deadline_passed(connection):
+    connection.circuit_breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0)
+    # The request is not made at all, that is not a failure of Holvi
+    with pytest.raises(holviapi.ApiTimeout):
+        with connection.deadline(0.01):
+            time.sleep(0.02)
+            connection.make_get(INVOICE_URL)
+    assert not connection.circuit_breaker.is_open
+    connection.circuit_breaker.record_failure()
+    with pytest.raises(holviapi.ApiTimeout):
+        with connection.deadline(0.01):
+            time.sleep(0.02)
+            connection.make_get(INVOICE_URL)
+    # The trial was released without a result, the next request is the trial
+    assert connection.circuit_breaker.failures == 1
+    connection.make_get(INVOICE_URL)
+    assert not connection.circuit_breaker.is_open
+    assert connection.session.calls == [('get', INVOICE_URL)]
+
+
+def test_broken_response_retried(connection):
+    connection.retry = RetryPolicy(backoff_factor=0)
+    connection.session = FirstFailsSession(connection.session.bodies,
+                                           requests.exceptions.ChunkedEncodingError("Connection broken"))
+    assert connection.make_get(INVOICE_URL)['code'] == 'abc'
+    assert len(connection.session.calls) == 2
+    connection.retry = RetryPolicy(total=0)
+    connection.session = FirstFailsSession(connection.session.bodies, requests.exceptions.ConnectionError("Refused"))
+    with pytest.raises(holviapi.ApiConnectionError):
+        connection.make_get(INVOICES_URL)
+
+
+class HangingSession(FakeSession):
+
+    def __init__(self, bodies):
+        super(HangingSession, self).__init__(bodies)
+        self.timeouts = []
+        self.release = threading.Event()
+
+    def head(self, url, **kwargs):
+        self.timeouts.append(kwargs.get('timeout'))
+        self.release.wait(5)
+
+
+def test_warmup_bounded_by_timeout(connection):
+    connection.timeout = (0.05, 0.05)
+    connection.session = HangingSession(connection.session.bodies)
+    started = time.time()
+    connection.warmup(3)
+    assert time.time() - started < 1
+    assert connection.session.timeouts == [(0.05, 0.05)] * 3
+    connection.session.release.set()
+
+
+class RetryAfterSession(FakeSession):
+
+    def __init__(self, bodies, retry_after):
+        super(RetryAfterSession, self).__init__(bodies, {INVOICE_URL: [503]})
+        self.retry_after = retry_after
+
+    def get(self, url, **kwargs):
+        r = super(RetryAfterSession, self).get(url, **kwargs)
+        if r.status_code == 503:
+            r.headers['Retry-After'] = self.retry_after
+        return r
+
+
+@pytest.mark.parametrize('retry_after, deadline, calls', [('0', None, 2), ('120', None, 1), ('1', 0.5, 1)])
+def test_retry_after(connection, retry_after, deadline, calls):
+    """Retry-After longer than max_backoff or the time left before the deadline is not shortened, we give up"""
+    connection.session = RetryAfterSession(connection.session.bodies, retry_after)
+    try:
+        with connection.deadline_at(deadline and holviapi.connection.now() + deadline):
+            connection.make_get(INVOICE_URL)
+    except holviapi.ApiError as e:
+        assert calls == 1
+        assert e.response.status_code == 503
+    assert len(connection.session.calls) == calls
+
+
+class SlowSession(FakeSession):
+
+    def get(self, url, **kwargs):
+        time.sleep(0.1)
+        return super(SlowSession, self).get(url, **kwargs)
+
+
+def test_concurrent_gets_coalesced(connection):
+    connection.session = SlowSession(connection.session.bodies)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(connection.make_get(INVOICE_URL))) for x in range(10)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(connection.session.calls) == 1
+    assert len(results) == 10
+    assert all(r == {'code': 'abc', 'subject': 'old'} for r in results)
+    # Each caller gets its own copy
+    assert len(set(id(r) for r in results)) == 10
+
+
+class Interrupted(BaseException):
+    pass
+
+
+class FirstFailsSession(SlowSession):
+    """The first GET raises error (after the delay of SlowSession), the rest succeed"""
+
+    def __init__(self, bodies, error):
+        super(FirstFailsSession, self).__init__(bodies)
+        self.error = error
+
+    def get(self, url, **kwargs):
+        response = super(FirstFailsSession, self).get(url, **kwargs)
+        if len(self.calls) == 1:
+            raise self.error
+        return response
+
+
+def _concurrent_gets(connection, count=5):
+    results = []
+
+    def get():
+        try:
+            results.append(connection.make_get(INVOICE_URL))
+        except BaseException as e:
+            results.append(e)
+
+    threads = [threading.Thread(target=get)]
+    threads[0].start()
+    time.sleep(0.02)  # Let the first one make the request
+    threads += [threading.Thread(target=get) for x in range(count - 1)]
+    for t in threads[1:]:
+        t.start()
+    for t in threads:
+        t.join()
+    return results
+
+
+def test_coalesced_error_copied(connection):
+    connection.retry = RetryPolicy(total=0)
+    connection.session = SlowSession(connection.session.bodies, statuses={INVOICE_URL: [404]})
+    results = _concurrent_gets(connection)
+    assert len(connection.session.calls) == 1
+    assert all(isinstance(r, holviapi.ApiError) for r in results)
+    assert results[-1].response.status_code == 404
+    assert len(set(id(r) for r in results)) == 5
+
+
+@pytest.mark.parametrize('error', [Interrupted(), requests.exceptions.Timeout("timed out")])
+def test_coalesced_owner_failure_retried(connection, error):
+    """Waiters make the request themselves when the one making it was interrupted or timed out"""
+    connection.retry = RetryPolicy(total=0)
+    connection.session = FirstFailsSession(connection.session.bodies, error)
+    results = _concurrent_gets(connection)
+    assert isinstance(results[0], (Interrupted, holviapi.ApiTimeout))
+    assert results[1:] == [{'code': 'abc', 'subject': 'old'}] * 4
+    # The waiters coalesce again for the second request
+    assert len(connection.session.calls) == 2
+
+
+def test_session_per_thread():
+    cnc = holviapi.Connection('testpool', 'testkey', session_per_thread=True, pool_maxsize=20)
+    sessions = []
+    threads = [threading.Thread(target=lambda: sessions.append(cnc._init_session())) for x in range(3)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(set(id(s) for s in sessions)) == 3
+    assert cnc._init_session() is cnc._init_session()
+    assert cnc._init_session().get_adapter('https://holvi.com/')._pool_maxsize == 20
+
+
+def test_singleton_threadsafe():
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(holviapi.Connection.singleton('threadpool', 'key')))
+               for x in range(10)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(set(id(c) for c in results)) == 1
+
+
+def test_deadline(connection):
+    connection.session = SlowSession(connection.session.bodies)
+    with pytest.raises(holviapi.ApiTimeout):
+        with connection.deadline(0.15):
+            connection.make_get(INVOICE_URL)
+            assert connection._request_timeout()[1] < 0.1
+            time.sleep(0.06)
+            connection.make_get(INVOICES_URL)
+    assert connection._get_deadline() is None
+    assert connection._request_timeout() == connection.timeout
+
+
+def test_deadline_carries_to_pagination(connection):
+    connection.session.bodies[INVOICES_URL] = {"count": 2, "next": INVOICES_URL + '2/', "results": [{"code": "o1", "purchases": []}]}
+    connection.session.bodies[INVOICES_URL + '2/'] = {"count": 2, "next": None, "results": [{"code": "o2", "purchases": []}]}
+    api = holviapi.CheckoutAPI(connection)
+    with connection.deadline(0.05):
+        orders = holviapi.checkout.OrderList(connection.make_get(INVOICES_URL), api)
+    time.sleep(0.06)
+    next(orders)
+    with pytest.raises(holviapi.ApiTimeout):
+        next(orders)
+
+
+def test_stats(connection):
+    events = []
+    connection.metrics.add_callback(lambda event, data: events.append(event))
+    connection.retry = RetryPolicy(backoff_factor=0)
+    connection.session.statuses[INVOICE_URL] = [502]
+    connection.make_get(INVOICE_URL)
+    connection.make_get(INVOICE_URL)
+    stats = connection.stats()['endpoints']['pool/{id}/invoice/{id}/']
+    assert stats['requests'] == 2
+    assert stats['errors'] == 1
+    assert stats['retries'] == 1
+    assert stats['cache_hits'] == 1
+    assert stats['cache_misses'] == 1
+    assert stats['bytes'] > 0
+    assert sum(stats['latency_buckets'].values()) == 2
+    assert events == ['cache', 'request', 'retry', 'request', 'cache']
+
+
+def test_endpoint_template():
+    assert endpoint_template('https://holvi.com/api/checkout/v2/order/abc123?x=1') == 'checkout/v2/order/{id}'
+    assert endpoint_template(INVOICE_URL + 'status/') == 'pool/{id}/invoice/{id}/status/'
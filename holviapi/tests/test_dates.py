@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+import datetime
+
+import dateutil.parser
+import pytest
+from holviapi.utils import parse_date, parse_datetime
+
+
+@pytest.mark.parametrize('value', [
+    '2016-01-20T10:11:12Z',
+    '2016-01-20T10:11:12.123456Z',
+    '2016-01-20T10:11:12.1234567Z',
+    '2016-01-20T10:11:12.12Z',
+    '2016-01-20T10:11:12+02:00',
+    '2016-01-20T10:11:12.5-05:30',
+    '2016-01-20T10:11:12+00:00',
+    '2016-01-20T10:11:12',
+    '2016-01-20 10:11:12Z',
+    '20 Jan 2016 10:11',  # Fallback
+])
+def test_parse_datetime_matches_dateutil(value):
+    parsed = parse_datetime(value)
+    expected = dateutil.parser.parse(value)
+    assert parsed == expected
+    assert parsed.utcoffset() == expected.utcoffset()
+
+
+def test_parse_date():
+    assert parse_date('2016-01-20') == datetime.date(2016, 1, 20)
+    assert parse_date('20.1.2016') == datetime.date(2016, 1, 20)
+    assert parse_date('2016-01-20T10:11:12Z') == datetime.date(2016, 1, 20)
+
+
+def test_empty_values():
+    assert parse_date(None) is None
+    assert parse_date('') is None
+    assert parse_datetime(None) is None
+    assert parse_datetime('') is None
+
+
+def test_invalid_values():
+    with pytest.raises(ValueError):
+        parse_date('2016-02-30')
+    with pytest.raises(ValueError):
+        parse_datetime('2016-01-20T25:11:12Z')
+
+
+def test_cached():
+    assert parse_datetime('2016-01-20T10:11:12Z') is parse_datetime('2016-01-20T10:11:12Z')
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+import gc
+
+import holviapi
+import pytest
+from holviapi.cache import MemoryCache, NullCache
+
+from .fixtures import FakeSession
+
+OPENBUDGET_URL = 'https://holvi.com/api/pool/testpool/openbudget/'
+OPENBUDGET = {
+    "products": [
+        {"code": "prod%d" % n, "name": "Product %d" % n, "category": "cat1",
+         "questions": [{"code": "q%d" % n, "label": "Size", "product": "prod%d" % n}]}
+        for n in range(3)
+    ],
+    "income_categories": [{"code": "cat1", "name": "Sales"}],
+    "expense_categories": [{"code": "cat2", "name": "Costs"}],
+}
+
+
+def _order(n):
+    return {"code": "ord%d" % n, "purchases": [
+        {"product": "prod%d" % (n % 3), "answers": [{"question": "q%d" % (n % 3), "answer": "XL"}]}]}
+
+
+@pytest.fixture
+def connection():
+    cnc = holviapi.Connection('testpool', 'testkey', cache=NullCache())
+    cnc.session = FakeSession({OPENBUDGET_URL: OPENBUDGET})
+    return cnc
+
+
+def test_shared_references(connection):
+    checkoutapi = holviapi.CheckoutAPI(connection)
+    orders = [holviapi.Order(checkoutapi, _order(n)) for n in range(6)]
+    assert orders[0].purchases[0].product is orders[3].purchases[0].product
+    assert orders[0].purchases[0].product is not orders[1].purchases[0].product
+    assert orders[0].purchases[0].answers[0].question is orders[3].purchases[0].answers[0].question
+
+
+def test_batch_resolution(connection):
+    checkoutapi = holviapi.CheckoutAPI(connection)
+    orders = [holviapi.Order(checkoutapi, _order(n)) for n in range(30)]
+    products = [order.purchases[0].product for order in orders]
+    questions = [order.purchases[0].answers[0].question for order in orders]
+    # All references known at the time are loaded by the first access
+    assert [product.name for product in products][:3] == ["Product 0", "Product 1", "Product 2"]
+    assert set(question.label for question in questions) == set(["Size"])
+    categories = [product.category for product in products]
+    assert categories[0] is categories[1]
+    assert categories[0].name == "Sales"
+    assert connection.session.calls == [('get', OPENBUDGET_URL)] * 2
+
+
+def test_resolve_references(connection):
+    invoicesapi = holviapi.InvoiceAPI(connection)
+    invoice = holviapi.Invoice(invoicesapi, {"code": "inv1", "items": [{"category": "cat1"}, {"category": "cat2"}]})
+    categories = [item.category for item in invoice.items]
+    assert isinstance(categories[1], holviapi.IncomeCategory)
+    assert invoicesapi.categories_api.resolve_references() == 1
+    assert categories[0].name == "Sales"
+    # Not found, stays lazy
+    assert categories[1]._lazy
+    assert len(connection.session.calls) == 1
+
+
+def test_references_are_weak(connection):
+    checkoutapi = holviapi.CheckoutAPI(connection)
+    holviapi.Order(checkoutapi, _order(1)).purchases[0].product
+    gc.collect()
+    assert len(connection.identity_map) == 0
+
+
+def test_indexed_lookups():
+    cnc = holviapi.Connection('testpool', 'testkey')
+    cnc.session = FakeSession({OPENBUDGET_URL: OPENBUDGET})
+    productsapi = holviapi.ProductsAPI(cnc)
+    assert productsapi.get_product("prod1").name == "Product 1"
+    assert productsapi.get_product("prod1") is not productsapi.get_product("prod1")
+    assert productsapi.get_product("missing") is None
+    assert productsapi.get_product("missing") is None
+    assert isinstance(productsapi.categories_api.get_category("cat1"), holviapi.IncomeCategory)
+    assert isinstance(productsapi.categories_api.get_category("cat2"), holviapi.ExpenseCategory)
+    assert productsapi.categories_api.get_category("missing") is None
+    product = productsapi.get_product("prod2")
+    assert product.get_question("q2").label == "Size"
+    assert product.get_question("q1") is None
+    assert len(cnc.session.calls) == 1
+    # The index is rebuilt from the new response
+    cnc.session.bodies = {OPENBUDGET_URL: {"products": [{"code": "new"}]}}
+    cnc.invalidate(OPENBUDGET_URL)
+    assert productsapi.get_product("prod1") is None
+    assert productsapi.get_product("new").code == "new"
+    assert len(cnc.session.calls) == 2
+
+
+def test_unknown_reference(connection):
+    checkoutapi = holviapi.CheckoutAPI(connection)
+    connection.cache = MemoryCache()
+    product = holviapi.Order(checkoutapi, {"code": "ord1", "purchases": [{"product": "missing"}]}).purchases[0].product
+    for x in range(3):
+        with pytest.raises(AttributeError):
+            product.name
+    assert len(connection.session.calls) == 1
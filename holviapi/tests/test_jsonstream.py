@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+import json
+
+import pytest
+from holviapi.jsonstream import StreamedPage
+
+
+def _chunks(data, size):
+    body = json.dumps(data).encode('utf-8')
+    return [body[i:i + size] for i in range(0, len(body), size)]
+
+
+@pytest.mark.parametrize('size', [1, 7, 4096])
+def test_array(size):
+    items = [{"code": "inv%d" % n, "subject": u"Äö €", "number": 1234567 * n, "nested": [1, {"a": None}]}
+             for n in range(20)]
+    assert list(StreamedPage(_chunks(items, size))) == items
+
+
+@pytest.mark.parametrize('size', [1, 5, 4096])
+def test_object(size):
+    data = {"count": 12345, "next": "https://example.com/page2/", "results": [{"code": "a"}, {"code": "b"}]}
+    page = StreamedPage(_chunks(data, size), key="results")
+    assert page["count"] == 12345
+    assert [item["code"] for item in page["results"]] == ["a", "b"]
+    assert page.get("next") == "https://example.com/page2/"
+    assert "missing" not in page
+
+
+def test_values_after_array():
+    body = b'{"results": [{"code": "a"}], "next": null, "count": 1}'
+    page = StreamedPage([body], key="results")
+    assert page.get("count") is None  # Not read yet
+    assert list(page["results"]) == [{"code": "a"}]
+    assert page["count"] == 1
+    assert page["next"] is None
+
+
+@pytest.mark.parametrize('chunks, expected', [
+    ([b'[12.', b'5, 3]'], [12.5, 3]),
+    ([b'[1e', b'5]'], [1e5]),
+    ([b'[1E+', b'2, -', b'0.5e-1]'], [100.0, -0.05]),
+    ([b'[12', b' , 1', b'3]'], [12, 13]),
+    ([b'{"results": [], "count": 4', b'2.0}'], 42.0),
+])
+def test_numbers_split_between_chunks(chunks, expected):
+    if isinstance(expected, list):
+        assert list(StreamedPage(chunks)) == expected
+    else:
+        page = StreamedPage(chunks, key="results")
+        assert list(page["results"]) == []
+        assert page["count"] == expected
+
+
+@pytest.mark.parametrize('size', [1, 2, 3])
+def test_floats(size):
+    items = [0.5, 12.25, -1e-05, 1.5e+300, 3, -7, 100.0]
+    assert list(StreamedPage(_chunks(items, size))) == items
+
+
+def test_empty():
+    assert list(StreamedPage([b' [ ] '])) == []
+    assert list(StreamedPage([b'{"results": []}'], key="results")) == []
+
+
+def test_iterated_once():
+    page = StreamedPage([b'[1, 2, 3]'])
+    items = iter(page)
+    assert next(items) == 1
+    with pytest.raises(ValueError):
+        list(page)
+
+
+def test_truncated():
+    with pytest.raises(ValueError):
+        list(StreamedPage([b'[{"code": "a"}, {"code": ']))
+
+
+def test_buffer_bounded_and_closed():
+    closed = []
+    items = [{"code": "inv%d" % n, "subject": "x" * 100} for n in range(1000)]
+    page = StreamedPage(_chunks(items, 256), close=lambda: closed.append(True))
+    sizes = []
+    for item in page:
+        sizes.append(len(page._buf))
+    assert max(sizes) < 1024
+    assert closed == [True]
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+import gc
+import threading
+import time
+
+import holviapi
+import pytest
+
+from .fixtures import FakeSession
+
+ORDERS_URL = 'https://holvi.com/api/checkout/v2/pool/testpool/order/'
+
+
+def _page(n, last):
+    return {
+        "count": last * 2,
+        "next": None if n == last else ORDERS_URL + 'page%d/' % (n + 1),
+        "results": [{"code": "o%d-%d" % (n, i), "purchases": []} for i in range(2)],
+    }
+
+
+@pytest.fixture
+def checkoutapi():
+    cnc = holviapi.Connection('testpool', 'testkey')
+    bodies = {ORDERS_URL: _page(1, 5)}
+    for n in range(2, 6):
+        bodies[ORDERS_URL + 'page%d/' % n] = _page(n, 5)
+    cnc.session = FakeSession(bodies)
+    return holviapi.CheckoutAPI(cnc)
+
+
+def test_pagination(checkoutapi):
+    codes = [o.code for o in checkoutapi.list_orders()]
+    assert len(codes) == 10
+    assert codes[0] == "o1-0"
+    assert codes[-1] == "o5-1"
+
+
+@pytest.mark.parametrize('depth', [1, 3, 10])
+def test_read_ahead(checkoutapi, depth):
+    orders = checkoutapi.list_orders().read_ahead(depth)
+    codes = [o.code for o in orders]
+    assert codes == [o.code for o in checkoutapi.list_orders()]
+    with pytest.raises(StopIteration):
+        next(orders)
+
+
+def test_read_ahead_close(checkoutapi):
+    orders = checkoutapi.list_orders().read_ahead(1)
+    assert next(orders).code == "o1-0"
+    orders.close()
+    # The rest are fetched without the read-ahead thread
+    assert [o.code for o in orders] == [o.code for o in checkoutapi.list_orders()][1:]
+
+
+def _read_ahead_threads():
+    targets = ((t, getattr(t, '_target', None)) for t in threading.enumerate())
+    return set(t for (t, target) in targets if getattr(target, '__name__', None) == '_read_ahead_worker')
+
+
+def _wait_for(condition, timeout=5):
+    end = time.time() + timeout
+    while not condition() and time.time() < end:
+        time.sleep(0.01)
+
+
+def test_read_ahead_context_manager(checkoutapi):
+    with checkoutapi.list_orders().read_ahead(1) as orders:
+        assert next(orders).code == "o1-0"
+        _wait_for(lambda: orders._pages.full())
+    assert orders._read_ahead_stop.is_set()
+
+
+def test_read_ahead_abandoned(checkoutapi):
+    before = _read_ahead_threads()
+    orders = checkoutapi.list_orders().read_ahead(1)
+    assert next(orders).code == "o1-0"
+    pages = orders._pages
+    _wait_for(pages.full)
+    worker = (_read_ahead_threads() - before).pop()
+    # Dropping the list without close() stops the worker blocked on the full queue
+    del orders
+    gc.collect()
+    worker.join(5)
+    assert not worker.is_alive()
+
+
+def test_streamed_pagination(checkoutapi):
+    orders = checkoutapi.list_orders(stream=True)
+    assert orders.streamed
+    assert len(orders) == 10
+    assert [o.code for o in orders] == [o.code for o in checkoutapi.list_orders()]
+
+
+def test_streamed_invoices():
+    cnc = holviapi.Connection('testpool', 'testkey')
+    invoices_url = 'https://holvi.com/api/pool/testpool/invoice/'
+    cnc.session = FakeSession({invoices_url: [{"code": "inv%d" % n, "items": []} for n in range(5)]})
+    invoices = holviapi.InvoiceAPI(cnc).list_invoices(stream=True)
+    with pytest.raises(TypeError):
+        len(invoices)
+    assert [i.code for i in invoices] == ["inv0", "inv1", "inv2", "inv3", "inv4"]
+    # Not cached
+    list(holviapi.InvoiceAPI(cnc).list_invoices(stream=True))
+    assert len(cnc.session.calls) == 2
@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+import datetime
+import sqlite3
+
+import dateutil.tz
+import holviapi
+import pytest
+from holviapi.mirror import Mirror
+
+from .fixtures import FakeSession
+
+INVOICES_URL = 'https://holvi.com/api/pool/testpool/invoice/'
+ORDERS_URL = 'https://holvi.com/api/checkout/v2/pool/testpool/order/'
+
+
+def _invoice(code, status, email, category, created, paid=None):
+    return {"code": code, "status": status, "receiver": {"name": "Person " + code, "email": email},
+            "create_time": created, "update_time": created, "paid_time": paid,
+            "issue_date": created[:10], "due_date": created[:10],
+            "items": [{"category": category, "detailed_price": {"net": "1.00", "gross": "1.24"}}]}
+
+
+def _order(code, email, product, created, paid=None):
+    return {"code": code, "email": email, "create_time": created, "update_time": paid or created, "paid_time": paid,
+            "status": "paid" if paid else "pending", "purchases": [{"product": product}]}
+
+
+@pytest.fixture
+def mirror(tmpdir):
+    cnc = holviapi.Connection('testpool', 'testkey')
+    cnc.session = FakeSession({
+        INVOICES_URL: [
+            _invoice("i1", "paid", "A@example.com", "cat1", "2016-01-20T10:00:00Z", "2016-01-21T10:00:00Z"),
+            _invoice("i2", "issued", "a@example.com", "cat2", "2016-02-20T10:00:00Z"),
+            _invoice("i3", "issued", "b@example.com", "cat1", "2016-03-20T10:00:00Z"),
+        ],
+        ORDERS_URL: {"count": 3, "next": None, "results": [
+            _order("o1", "a@example.com", "prod1", "2016-01-20T10:00:00Z", "2016-01-20T10:05:00Z"),
+            _order("o2", "a@example.com", "prod2", "2016-01-21T10:00:00Z"),
+            _order("o3", "b@example.com", "prod1", "2016-01-22T10:00:00Z"),
+        ]},
+    })
+    mirror = Mirror(cnc, str(tmpdir.join('mirror.sqlite')))
+    result = mirror.sync()
+    assert result['invoices']['upserted'] == 3
+    assert result['orders']['upserted'] == 3
+    return mirror
+
+
+def test_query_invoices(mirror):
+    assert [i.code for i in mirror.query_invoices(email="a@EXAMPLE.com")] == ["i2", "i1"]
+    assert [i.code for i in mirror.query_invoices(status="issued", category="cat1")] == ["i3"]
+    assert [i.code for i in mirror.query_invoices(paid=True)] == ["i1"]
+    assert [i.code for i in mirror.query_invoices(receiver="son i3")] == ["i3"]
+    assert [i.code for i in mirror.query_invoices(created_from=datetime.date(2016, 2, 1),
+                                                  created_to="2016-02-28T00:00:00Z")] == ["i2"]
+    assert [i.code for i in mirror.query_invoices(limit=1)] == ["i3"]
+    invoice = mirror.get_invoice("i1")
+    assert isinstance(invoice, holviapi.Invoice)
+    assert invoice.items[0].category.code == "cat1"
+    assert mirror.get_invoice("missing") is None
+
+
+def test_query_orders(mirror):
+    assert [o.code for o in mirror.query_orders(email="a@example.com", paid=False)] == ["o2"]
+    assert [o.code for o in mirror.query_orders(product="prod1")] == ["o3", "o1"]
+    assert [o.code for o in mirror.query_orders(status="pending", email="b@example.com")] == ["o3"]
+    assert mirror.get_order("o1").paid_time == datetime.datetime(2016, 1, 20, 10, 5, tzinfo=dateutil.tz.tzutc())
+
+
+def test_upsert_and_delete(mirror):
+    order = mirror.get_order("o2")
+    order._jsondata["paid_time"] = "2016-01-23T10:00:00Z"
+    order._jsondata["purchases"] = [{"product": "prod3"}]
+    mirror.upsert(order)
+    assert [o.code for o in mirror.query_orders(paid=False)] == ["o3"]
+    assert [o.code for o in mirror.query_orders(product="prod3")] == ["o2"]
+    assert mirror.query_orders(product="prod2") == []
+    mirror.delete_order("o2")
+    assert mirror.get_order("o2") is None
+    mirror.delete_invoice("i1")
+    assert mirror.query_invoices(category="cat1")[0].code == "i3"
+
+
+def test_incremental_sync(mirror):
+    assert mirror.get('testpool:invoices')['mark'] == '2016-03-20T10:00:00+00:00'
+    session = mirror.connection.session
+    session.bodies[INVOICES_URL] = session.bodies[INVOICES_URL][2:]
+    result = mirror.sync()
+    assert result['invoices']['upserted'] == 0
+    assert mirror.connection.session.params[-2] == {'update_time_from': '2016-03-20T09:55:00.000000Z'}
+
+
+def test_pools_share_database(mirror):
+    cnc = holviapi.Connection('otherpool', 'testkey')
+    cnc.session = FakeSession({})
+    other = Mirror(cnc, mirror.path)
+    assert other.query_invoices() == []
+    assert other.get_order("o1") is None
+    order = mirror.get_order("o1")
+    order._jsondata["email"] = "other@example.com"
+    other.upsert(order)
+    other.delete_invoice("i1")
+    assert [o.code for o in other.query_orders(product="prod1")] == ["o1"]
+    assert mirror.get_order("o1").email == "a@example.com"
+    assert mirror.get_invoice("i1") is not None
+
+
+def test_old_schema_rebuilt(tmpdir):
+    path = str(tmpdir.join('old.sqlite'))
+    db = sqlite3.connect(path)
+    db.execute("CREATE TABLE invoices (code TEXT PRIMARY KEY, json TEXT)")
+    db.execute("CREATE TABLE marks (key TEXT PRIMARY KEY, state TEXT)")
+    db.execute("INSERT INTO marks VALUES ('testpool:invoices', '{}')")
+    db.commit()
+    db.close()
+    cnc = holviapi.Connection('testpool', 'testkey')
+    mirror = Mirror(cnc, path)
+    assert mirror.get('testpool:invoices') is None
+    assert mirror.query_invoices() == []
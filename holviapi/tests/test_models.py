@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+import datetime
+from decimal import Decimal
+
+import holviapi
+import pytest
+
+INVOICE = {
+    "code": "inv1",
+    "status": "outbound",
+    "currency": "EUR",
+    "subject": "Test",
+    "number": 1,
+    "type": "outbound",
+    "issue_date": "2016-01-20",
+    "due_date": "2016-02-03",
+    "receiver": {"name": "Example Person", "email": "example@example.com"},
+    "items": [{"description": "Thing", "category": "cat1", "detailed_price": {"net": "10.00", "gross": "12.40"}}],
+    "unknown_key": 1,
+}
+
+ORDER = {
+    "code": "ord1",
+    "firstname": "Example",
+    "email": "example@example.com",
+    "create_time": "2016-01-20T10:11:12.123456Z",
+    "paid_time": None,
+    "purchases": [{"product": "prod1", "detailed_price": {"net": "10.00", "gross": "12.40"},
+                   "answers": [{"question": "q1", "label": "Size", "answer": "XL"}]}],
+}
+
+
+@pytest.fixture
+def invoicesapi():
+    return holviapi.InvoiceAPI(holviapi.Connection('testpool', 'testkey'))
+
+
+@pytest.fixture
+def checkoutapi():
+    return holviapi.CheckoutAPI(holviapi.Connection('testpool', 'testkey'))
+
+
+def test_invoice_slots(invoicesapi):
+    invoice = holviapi.Invoice(invoicesapi, dict(INVOICE))
+    assert not hasattr(invoice, '__dict__')
+    assert not hasattr(invoice.items[0], '__dict__')
+    assert not hasattr(invoice.receiver, '__dict__')
+    assert invoice.code == "inv1"
+    assert invoice.subject == "Test"
+    assert invoice.unknown_key == 1
+    assert invoice.issue_date == datetime.date(2016, 1, 20)
+    assert invoice.items[0].net == Decimal("10.00")
+    assert invoice.receiver.name == "Example Person"
+    with pytest.raises(AttributeError):
+        invoice.missing_key
+
+
+def test_invoice_setattr_round_trip(invoicesapi):
+    invoice = holviapi.Invoice(invoicesapi, dict(INVOICE))
+    invoice.subject = "Changed"
+    invoice.receiver.email = "changed@example.com"
+    invoice.items[0].description = "Other thing"
+    invoice.items[0].net = Decimal("5")
+    invoice.new_key = "new"
+    assert invoice._jsondata["new_key"] == "new"
+    data = invoice.to_holvi_dict()
+    assert data["subject"] == "Changed"
+    assert data["receiver"]["email"] == "changed@example.com"
+    assert data["items"][0]["description"] == "Other thing"
+    assert data["items"][0]["detailed_price"]["net"] == "5.00"
+    assert data["issue_date"] == "2016-01-20"
+
+
+def test_new_invoice(invoicesapi):
+    invoice = holviapi.Invoice(invoicesapi)
+    invoice.items.append(holviapi.InvoiceItem(invoice))
+    invoice.items[0].net = Decimal("25.50")
+    invoice.subject = "New"
+    data = invoice.to_holvi_dict()
+    assert data["items"][0]["detailed_price"] == {"net": "25.50", "gross": "25.50"}
+    assert data["subject"] == "New"
+
+
+def test_order_slots(checkoutapi):
+    order = holviapi.Order(checkoutapi, dict(ORDER))
+    assert not hasattr(order, '__dict__')
+    assert not hasattr(order.purchases[0], '__dict__')
+    assert order.firstname == "Example"
+    assert order.buyer.email == "example@example.com"
+    assert order.create_time.year == 2016
+    assert order.paid_time is None
+    assert order.net == Decimal("10.00")
+    assert order.purchases[0].product.code == "prod1"
+    assert order.purchases[0].answers[0].answer == "XL"
+    data = order.to_holvi_dict()
+    assert data["purchases"][0]["product"] == "prod1"
+    assert data["purchases"][0]["answers"][0] == {"question": "q1", "label": "Size", "answer": "XL"}
+
+
+def test_order_decoded_lazily(checkoutapi):
+    order = holviapi.Order(checkoutapi, dict(ORDER))
+    for slot in ('_buyer', '_purchases', '_create_time'):
+        with pytest.raises(AttributeError):
+            object.__getattribute__(order, slot)
+    assert order.purchases is order.purchases
+    order.purchases = []
+    # Replacing the data decodes again from the new JSON
+    order._hydrate(dict(ORDER))
+    assert len(order.purchases) == 1
+    order.purchases = []
+    assert order.to_holvi_dict()["purchases"] == []
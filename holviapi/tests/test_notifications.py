@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+import json
+import threading
+import time
+from wsgiref.simple_server import WSGIRequestHandler, make_server
+
+import holviapi
+import pytest
+import requests
+from holviapi.mirror import Mirror
+from holviapi.notifications import NotificationReceiver, code_from_request
+
+from .fixtures import FakeSession
+
+ORDER_URL = 'https://holvi.com/api/checkout/v2/order/o1'
+ORDERS_URL = 'https://holvi.com/api/checkout/v2/pool/testpool/order/'
+
+
+class QuietHandler(WSGIRequestHandler):
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def checkoutapi():
+    cnc = holviapi.Connection('testpool', 'testkey')
+    cnc.session = FakeSession({
+        ORDER_URL: {"code": "o1", "email": "a@example.com", "paid_time": None, "purchases": []},
+        ORDERS_URL: {"count": 0, "next": None, "results": []},
+    })
+    return holviapi.CheckoutAPI(cnc)
+
+
+@pytest.fixture
+def server():
+    """Runs a WSGI application in a local HTTP server, returns function taking the app and returning the url"""
+    servers = []
+
+    def serve(app):
+        httpd = make_server('127.0.0.1', 0, app, handler_class=QuietHandler)
+        t = threading.Thread(target=httpd.serve_forever)
+        t.daemon = True
+        t.start()
+        servers.append(httpd)
+        return 'http://127.0.0.1:%d/' % httpd.server_port
+
+    yield serve
+    for httpd in servers:
+        httpd.shutdown()
+        httpd.server_close()
+
+
+def test_code_from_request():
+    assert code_from_request('code=o1') == 'o1'
+    assert code_from_request('', b'order_code=o2', 'application/x-www-form-urlencoded') == 'o2'
+    assert code_from_request('', b'{"code": "o3"}', 'application/json') == 'o3'
+    assert code_from_request('', b'{"details_uri": "https://holvi.com/api/checkout/v2/order/o4/"}',
+                             'application/json') == 'o4'
+    assert code_from_request('', b'not json', 'application/json') is None
+    assert code_from_request('other=1') is None
+
+
+def test_notify_refreshes_cache_and_mirror(checkoutapi, tmpdir):
+    session = checkoutapi.connection.session
+    mirror = Mirror(checkoutapi.connection, str(tmpdir.join('mirror.sqlite')))
+    updated = []
+    receiver = NotificationReceiver(checkoutapi, mirror=mirror, debounce=0, on_update=updated.append)
+    assert checkoutapi.get_order('o1').paid_time is None
+    list(checkoutapi.list_orders())
+    assert len(session.calls) == 2
+    session.bodies[ORDER_URL] = dict(session.bodies[ORDER_URL], paid_time="2016-01-20T10:05:00Z")
+    receiver.notify('o1')
+    assert [o.code for o in updated] == ['o1']
+    assert mirror.get_order('o1').paid_time is not None
+    # The refreshed order is served from the cache, the listing is fetched again
+    assert checkoutapi.get_order('o1').paid_time is not None
+    list(checkoutapi.list_orders())
+    assert session.calls[2:] == [('get', ORDER_URL), ('get', ORDERS_URL)]
+
+
+def test_debounce(checkoutapi):
+    session = checkoutapi.connection.session
+    updated = []
+    receiver = NotificationReceiver(checkoutapi, debounce=60, on_update=updated.append)
+    for x in range(5):
+        receiver.notify('o1')
+    assert updated == []
+    assert session.calls == []
+    receiver.flush()
+    assert len(updated) == 1
+    assert session.calls == [('get', ORDER_URL)]
+    receiver.notify('o1')
+    receiver.close()
+    receiver.flush()
+    assert len(updated) == 1
+
+
+def _wait_for(condition, timeout=5):
+    end = time.time() + timeout
+    while not condition() and time.time() < end:
+        time.sleep(0.01)
+
+
+def test_timer_failure_retried(checkoutapi, caplog):
+    updated = []
+
+    def on_update(order):
+        updated.append(order)
+        if len(updated) == 1:
+            raise RuntimeError("Storing failed")
+
+    receiver = NotificationReceiver(checkoutapi, debounce=0.01, on_update=on_update)
+    receiver.notify('o1')
+    _wait_for(lambda: len(updated) == 2)
+    assert len(updated) == 2
+    assert "Refreshing order o1 failed" in caplog.text
+
+
+def test_timer_gives_up(checkoutapi, caplog):
+    checkoutapi.connection.session.statuses[ORDER_URL] = [404] * 3
+    errors = []
+    receiver = NotificationReceiver(checkoutapi, debounce=0.01, retries=2,
+                                    on_error=lambda code, e: errors.append(code))
+    receiver.notify('o1')
+    _wait_for(lambda: "Giving up" in caplog.text)
+    assert errors == ['o1'] * 3
+    assert "Giving up refreshing order o1 after 3 tries" in caplog.text
+
+
+def test_flush_waits_for_running_refresh(checkoutapi):
+    updated = []
+
+    def on_update(order):
+        time.sleep(0.2)
+        updated.append(order)
+
+    receiver = NotificationReceiver(checkoutapi, debounce=0.01, on_update=on_update)
+    receiver.notify('o1')
+    time.sleep(0.1)  # The timer has fired and is storing the order
+    receiver.flush()
+    assert len(updated) == 1
+
+
+def test_errors(checkoutapi):
+    checkoutapi.connection.session.statuses[ORDER_URL] = [404]
+    errors = []
+    receiver = NotificationReceiver(checkoutapi, debounce=0, on_error=lambda code, e: errors.append((code, e)))
+    receiver.notify('o1')
+    assert errors[0][0] == 'o1'
+    assert isinstance(errors[0][1], holviapi.HolviError)
+
+
+def test_wsgi_app(checkoutapi, server):
+    updated = []
+    receiver = NotificationReceiver(checkoutapi, debounce=0, on_update=updated.append)
+    url = server(receiver.wsgi_app)
+    assert requests.post(url + '?code=o1').status_code == 200
+    r = requests.post(url, data=json.dumps({"code": "o1"}), headers={'Content-Type': 'application/json'})
+    assert r.status_code == 200
+    assert requests.post(url, data={'something': 'else'}).status_code == 400
+    assert [o.code for o in updated] == ['o1', 'o1']
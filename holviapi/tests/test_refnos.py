@@ -5,8 +5,12 @@ import pytest
 from holviapi.utils import (
     ISO_REFERENCE_VALID,
     fin_reference_isvalid,
+    fin_references,
+    fin_references_valid,
     int2fin_reference,
     iso_reference_isvalid,
+    iso_references,
+    iso_references_valid,
     str2iso_reference
 )
 
@@ -90,3 +94,40 @@ def test_str2iso_reference_random_strings():
             teststr += random.choice(ISO_REFERENCE_VALID)
         reference = str2iso_reference(teststr)
         assert iso_reference_isvalid(reference)
+
+
+def test_fin_references_matches_single():
+    numbers = list(range(0, 3000)) + [random.randint(1, 2**40) for x in range(1000)]
+    references = list(fin_references(numbers))
+    assert references == [int2fin_reference(n) for n in numbers]
+    assert list(fin_references(['10552', '0012'])) == ['105523', int2fin_reference('0012')]
+    assert all(fin_references_valid(references))
+
+
+def test_fin_references_valid():
+    assert list(fin_references_valid([13, '105523', 1071110, '10552X', '', 'abc'])) == [
+        True, True, False, False, False, False]
+    # Non-ASCII digits are invalid, not errors
+    assert list(fin_references_valid([u'\u00b2', u'1\u00b2', u'\u0661\u0663'])) == [False, False, False]
+
+
+def test_iso_references_matches_single():
+    values = [random.randint(1, 2**40) for x in range(1000)]
+    values += [''.join(random.choice(ISO_REFERENCE_VALID) for y in range(random.randint(1, 21))) for x in range(1000)]
+    references = list(iso_references(values))
+    assert references == [str2iso_reference(str(v)) for v in values]
+    assert list(iso_references(['C2H5OH', 'c2h5oh'])) == ['RF97C2H5OH', 'RF97c2h5oh']
+    assert all(iso_references_valid(references))
+    with pytest.raises(ValueError):
+        list(iso_references(['C2H5-OH']))
+
+
+def test_iso_references_valid():
+    assert list(iso_references_valid(['RF97C2H5OH', 'rf97c2h5oh', 'RF40C2H5OH', 'RF97C2H5-OH', '', 'RF'])) == [
+        True, True, False, False, False, False]
+
+
+def test_iso_reference_str2int_invalid_char():
+    with pytest.raises(ValueError) as e:
+        iso_reference_isvalid('RF97C2H5-OH')
+    assert "'-'" in str(e.value)
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+import holviapi
+import pytest
+from holviapi.sync import DeltaSync, FileMarkStore
+
+from .fixtures import FakeSession
+
+INVOICES_URL = 'https://holvi.com/api/pool/testpool/invoice/'
+ORDERS_URL = 'https://holvi.com/api/checkout/v2/pool/testpool/order/'
+
+
+def _invoice(code, updated):
+    return {"code": code, "update_time": updated, "items": []}
+
+
+@pytest.fixture
+def connection():
+    cnc = holviapi.Connection('testpool', 'testkey')
+    cnc.session = FakeSession({
+        INVOICES_URL: [_invoice("a", "2016-01-20T10:00:00Z"), _invoice("b", "2016-01-20T11:00:00Z")],
+        ORDERS_URL: {"count": 2, "next": None, "results": [
+            {"code": "o1", "update_time": "2016-01-20T10:00:00Z", "purchases": []},
+            {"code": "o1", "update_time": "2016-01-20T10:00:00Z", "purchases": []}]},
+    })
+    return cnc
+
+
+def test_sync_invoices(connection, tmpdir):
+    marks = FileMarkStore(str(tmpdir.join('marks.json')))
+    sync = DeltaSync(connection, marks=marks, overlap=600)
+    upserted = []
+    result = sync.sync_invoices(upserted.append)
+    assert [i.code for i in upserted] == ["a", "b"]
+    assert result['fetched'] == 2
+    assert connection.session.params[-1] == {}
+    # Nothing changed, the overlap brings "b" again but it is not upserted twice
+    del upserted[:]
+    sync = DeltaSync(connection, marks=FileMarkStore(str(tmpdir.join('marks.json'))), overlap=600)
+    connection.session.bodies[INVOICES_URL] = [_invoice("b", "2016-01-20T11:00:00Z")]
+    assert sync.sync_invoices(upserted.append)['upserted'] == 0
+    assert connection.session.params[-1] == {'update_time_from': '2016-01-20T10:50:00.000000Z'}
+    # Changed again
+    connection.session.bodies[INVOICES_URL] = [_invoice("b", "2016-01-20T11:00:00Z"),
+                                               _invoice("c", "2016-01-20T11:01:00Z"),
+                                               _invoice("b", "2016-01-20T11:02:00Z")]
+    assert sync.sync_invoices(upserted.append)['upserted'] == 2
+    assert [(i.code, i.update_time) for i in upserted] == [("c", "2016-01-20T11:01:00Z"), ("b", "2016-01-20T11:02:00Z")]
+    assert connection.session.params[-1] == {'update_time_from': '2016-01-20T10:50:00.000000Z'}
+    assert sync.marks.get('testpool:invoices')['mark'] == '2016-01-20T11:02:00+00:00'
+    # Full sync ignores the mark
+    del upserted[:]
+    sync.sync_invoices(upserted.append, full=True)
+    assert len(upserted) == 3
+    assert connection.session.params[-1] == {}
+
+
+def test_sync_orders_dedupe(connection):
+    sync = DeltaSync(connection)
+    upserted = []
+    assert sync.sync_orders(upserted.append)['fetched'] == 2
+    assert [o.code for o in upserted] == ["o1"]
+    sync.sync_orders(upserted.append)
+    assert connection.session.params[-1] == {'filter_update_time_from': '2016-01-20T09:55:00.000000Z'}
+    assert len(upserted) == 1
+
+
+def test_mark_not_advanced_on_error(connection):
+    sync = DeltaSync(connection)
+
+    def upsert(invoice):
+        if invoice.code == "b":
+            raise ValueError("store down")
+    with pytest.raises(ValueError):
+        sync.sync_invoices(upsert)
+    assert sync.marks.get('testpool:invoices') is None
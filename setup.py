@@ -27,5 +27,8 @@ setup(
     long_description=open('README.md').read(),
     description='Implement Pythonic wrappers for Holvi JSON-REST API',
     install_requires=list(filter(bool, (x.strip() for x in open('requirements.txt').readlines()))),
+    extras_require={
+        'async': ['aiohttp'],
+    },
     url='https://github.com/rambo/python-holviapi',
 )